@@ -20,7 +20,14 @@ fixed_config = {"d": 5,
                 "max_timesteps": 1000000,
                 "volume_depth": 5,
                 "testing_length": 101,
+                "testing_confidence": 0.99,
+                "testing_min_episodes": 50,
+                "fast_forward": True,
                 "buffer_size": 50000,
+                "deduplicated_memory": True,
+                "prioritized_replay": False,
+                "n_actors": 0,
+                "actor_weight_update_freq": 1000,
                 "dueling": True,
                 "masked_greedy": False,
                 "static_decoder": True}
@@ -41,6 +48,7 @@ max_eps_list = [1.0]
 target_network_update_freq_list = [2500, 5000]
 gamma_list = [0.99]
 final_eps_list = [0.04, 0.02, 0.001]
+evaluation_time_limit = "04"
 
 config_counter = 1
 for ls in learning_starts_list:
@@ -77,7 +85,10 @@ for ls in learning_starts_list:
                             job_name=str(p_phys)+"_"+str(config_counter)
                             output_file = os.path.join(cwd,"output_files/out_"+job_name+".out")
                             error_file = os.path.join(cwd,"output_files/err_"+job_name+".err")
-                            python_script = os.path.join(cwd, "Single_Point_Training_Script.py")
+                            if fixed_config["n_actors"] > 0:
+                                python_script = os.path.join(cwd, "../Actor_Learner_Training_Script.py")
+                            else:
+                                python_script = os.path.join(cwd, "Single_Point_Training_Script.py")
 
 
                             f = open(config_directory + "/simulation_script.sh",'w')  
@@ -109,4 +120,36 @@ python '''+python_script+''' '''+str(config_counter)+'''
 
 sleep 50''')
                             f.close()
+
+                            # The evaluation over a sweep of error rates is submitted as a separate job, once training has finished
+                            evaluation_job_name = "eval_"+job_name
+                            evaluation_output_file = os.path.join(cwd,"output_files/out_"+evaluation_job_name+".out")
+                            evaluation_error_file = os.path.join(cwd,"output_files/err_"+evaluation_job_name+".err")
+                            evaluation_script = os.path.join(cwd, "../Single_Point_Evaluation_Script.py")
+
+                            f = open(config_directory + "/evaluation_script.sh",'w')  
+                            f.write('''#!/bin/bash
+
+#SBATCH --job-name='''+evaluation_job_name+'''     # Job name, will show up in squeue output
+#SBATCH --ntasks=4                           # Number of cores - one evaluation worker per core
+#SBATCH --nodes=1                            # Ensure that all cores are on one machine
+#SBATCH --time=0-'''+evaluation_time_limit+''':00:00     # Runtime in DAYS-HH:MM:SS format
+#SBATCH --mem-per-cpu=1000                   # Memory per cpu in MB (see also --mem) 
+#SBATCH --output='''+evaluation_output_file+'''         # File to which standard out will be written
+#SBATCH --error='''+evaluation_error_file+'''           # File to which standard err will be written
+
+# store job info in output file, if you want...
+scontrol show job $SLURM_JOBID
+
+
+# ---------------------- JOB SCRIPT ---------------------------------------------
+
+# ----------- Activate the environment  -----------------------------------------
+
+#module load python/3.6.5
+
+# ------- run the script -----------------------
+
+python '''+evaluation_script+''' '''+str(config_counter)+''' '''+cwd+''' 4''')
+                            f.close()
                             config_counter += 1 
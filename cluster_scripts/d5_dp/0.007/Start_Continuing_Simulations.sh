@@ -4,5 +4,6 @@ directory=$1
 
 for d in "$directory"*/ ; do
     script_path="${d}simulation_script.sh"
-    sbatch $script_path 
-done
\ No newline at end of file
+    job_id=$(sbatch --parsable $script_path)
+    sbatch --dependency=afterok:$job_id "${d}evaluation_script.sh"
+done
@@ -0,0 +1,376 @@
+# ------------ This script runs a training cycle for a single configuration point, with several actor processes ----------------
+#
+# usage: python Actor_Learner_Training_Script.py config_number [p_phys_directory]
+#
+# This is an alternative to Single_Point_Training_Script.py and Single_Point_Continue_Training_Script.py, which is used when the
+# fixed configuration contains "n_actors" > 0. Each of the n_actors actor processes runs its own copy of the environment, choosing
+# actions epsilon-greedily with a NumpyDQN copy of the agent, and sends the resulting transitions to this (learner) process. The
+# learner owns the Keras model and the replay memory, performs the updates of the DQN agent for every transition it receives, and
+# periodically publishes the current weights to the actors through shared memory.
+#
+# If "config_x/initial_dqn_weights.h5f" exists then training continues from these weights, and from the memory in "config_x/memory/".
+
+import os
+import sys
+import json
+import pickle
+import queue
+import random
+import datetime
+import multiprocessing
+from collections import deque
+
+from Function_Library import *
+from Environments import *
+
+# ---------------------------------------------------------------------------------------------
+
+def build_convolutional_nn(cc_layers,ff_layers, input_shape, num_actions):
+
+    from keras.models import Sequential
+    from keras.layers import Dense, Dropout, Activation, Flatten, Conv2D
+
+    # cc_layers =[num_filters, kernel_size,strides]
+
+    model = Sequential()
+    model.add(Conv2D(filters=cc_layers[0][0],
+                     kernel_size=cc_layers[0][1],
+                     strides=cc_layers[0][2],
+                     input_shape=input_shape,
+                     data_format='channels_first'))
+    model.add(Activation('relu'))
+
+    for j in range(1,len(cc_layers)):
+            model.add(Conv2D(filters=cc_layers[j][0],
+                     kernel_size=cc_layers[j][1],
+                     strides=cc_layers[j][2],
+                     data_format='channels_first'))
+            model.add(Activation('relu'))
+
+    model.add(Flatten())
+
+    for j in range(len(ff_layers)):
+        model.add(Dense(ff_layers[j][0]))
+        model.add(Activation('relu'))
+        model.add(Dropout(rate=ff_layers[j][1]))
+
+    model.add(Dense(num_actions))
+    model.add(Activation('linear'))
+
+    return model
+
+
+def publish_weights(weights, shared_weights, weights_lock, shared_step, step):
+    """"
+    Copies the weights of the learner into shared memory, from which the actors pick them up.
+
+    :param: weights: The list of kernels and biases of the learner's model
+    :param: shared_weights: The shared array holding all the weights, flattened
+    :param: weights_lock: The lock protecting the shared weights
+    :param: shared_step: The shared value holding the learner step at which the weights were published
+    :param: step: The current learner step
+    """
+
+    flat_weights = np.frombuffer(shared_weights, np.float32)
+    with weights_lock:
+        flat_weights[:] = np.concatenate([np.ravel(weight) for weight in weights])
+        shared_step.value = step
+
+
+def fetch_weights(weight_shapes, shared_weights, weights_lock, shared_step):
+    """"
+    Copies the most recently published weights out of shared memory.
+
+    :return: weights: The list of kernels and biases
+    :return: step: The learner step at which the weights were published
+    """
+
+    with weights_lock:
+        flat_weights = np.frombuffer(shared_weights, np.float32).copy()
+        step = shared_step.value
+
+    weights = []
+    offset = 0
+    for shape in weight_shapes:
+        size = int(np.prod(shape))
+        weights.append(flat_weights[offset:offset + size].reshape(shape))
+        offset += size
+
+    return weights, step
+
+# ---------------------------------------------------------------------------------------------
+
+def load_static_decoder(all_configs, base_directory):
+    """"
+    Loads the referee decoder - the lookup table if it is available, otherwise the Keras static decoder.
+
+    :param: all_configs: The dictionary containing both the fixed and variable configuration of this point
+    :param: base_directory: The error rate directory, which is one level below the referee decoder
+    :return: static_decoder: The referee decoder
+    """
+
+    if all_configs["static_decoder"] and os.path.exists(os.path.join(base_directory, "../referee_table")):
+      static_decoder = RefereeLookupTable(os.path.join(base_directory, "../referee_table"))
+      if not static_decoder.dense:
+        from keras.models import load_model
+        static_decoder.fallback_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
+    elif all_configs["static_decoder"]:
+      from keras.models import load_model
+      static_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
+    else:
+      static_decoder = None
+
+    return static_decoder
+
+
+def build_env(all_configs, static_decoder):
+
+    return Surface_Code_Environment_Multi_Decoding_Cycles(d=all_configs["d"],
+        p_phys=all_configs["p_phys"],
+        p_meas=all_configs["p_meas"],
+        error_model=all_configs["error_model"],
+        use_Y=all_configs["use_Y"],
+        volume_depth=all_configs["volume_depth"],
+        static_decoder=static_decoder,
+        fast_forward=all_configs.get("fast_forward", True))
+
+
+def run_actor(actor_index, all_configs, base_directory, final_eps, weight_shapes, shared_weights, weights_lock, shared_step, 
+              transition_queue, seed, send_interval=100):
+    """"
+    The loop of a single actor process. The actor keeps acting in its own environment with the most recently published weights, 
+    sending its transitions to the learner once it has collected at least send_interval of them. Transitions are only ever sent
+    at the end of an episode, so that the learner receives whole episodes, which it can append to its sequential memory without 
+    breaking the link between consecutive observations. Its exploration rate is annealed linearly from max_eps to final_eps over
+    the first exploration_fraction steps of the learner. The actor runs until it is terminated by the learner.
+
+    :param: actor_index: The index of this actor
+    :param: all_configs: The dictionary containing both the fixed and variable configuration of this point
+    :param: base_directory: The error rate directory, which is one level below the referee decoder
+    :param: final_eps: The final exploration rate of this actor
+    :param: weight_shapes: The shapes of the kernels and biases of the learner's model
+    :param: shared_weights: The shared array holding all the weights, flattened
+    :param: weights_lock: The lock protecting the shared weights
+    :param: shared_step: The shared value holding the learner step at which the weights were published
+    :param: transition_queue: The queue into which (actor_index, transitions, episode_lifetimes) are put
+    :param: seed: The seed of the random number generators of this actor
+    :param: send_interval: The minimum number of transitions sent to the learner at once
+    """
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    env = build_env(all_configs, load_static_decoder(all_configs, base_directory))
+
+    weights_step = None
+    transitions = []
+    episode_lifetimes = []
+    observation = env.reset()
+
+    while True:
+
+        # Update to the most recently published weights
+        if shared_step.value != weights_step:
+            weights, weights_step = fetch_weights(weight_shapes, shared_weights, weights_lock, shared_step)
+            agent = build_numpy_dqn(weights, all_configs)
+            eps = all_configs["max_eps"] - (all_configs["max_eps"] - final_eps)*min(1.0, weights_step/all_configs["exploration_fraction"])
+
+        # Act epsilon-greedily, if required only amongst the legal actions
+        if all_configs["masked_greedy"]:
+            legal_actions = sorted(env.legal_actions)
+        else:
+            legal_actions = range(env.num_actions)
+        if random.random() < eps:
+            action = random.choice(legal_actions)
+        else:
+            q_values = agent.q_values(observation)
+            action = legal_actions[int(np.argmax(q_values[legal_actions]))]
+
+        # The environment updates its board in place, so the observation has to be copied before stepping
+        observation0 = np.array(observation, np.uint8)
+        next_observation, reward, done, info = env.step(action)
+        transitions.append((observation0, action, reward, done))
+
+        if done:
+            # As in keras-rl, the final observation of an episode is stored as well
+            transitions.append((np.array(next_observation, np.uint8), env.identity_index, 0., False))
+            episode_lifetimes.append(env.lifetime)
+            observation = env.reset()
+
+            if len(transitions) >= send_interval:
+                transition_queue.put((actor_index, transitions, episode_lifetimes))
+                transitions = []
+                episode_lifetimes = []
+        else:
+            observation = next_observation
+
+# ---------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    from keras.optimizers import Adam
+
+    from rl.agents.dqn import DQNAgent
+    from rl.policy import LinearAnnealedPolicy, EpsGreedyQPolicy, GreedyQPolicy
+
+    variable_config_number = sys.argv[1]
+    if len(sys.argv) > 2:
+        base_directory = sys.argv[2]
+    else:
+        base_directory = os.getcwd()
+
+    variable_configs_folder = os.path.join(base_directory, "./config_"+str(variable_config_number) + "/")
+    variable_configs_path = os.path.join(variable_configs_folder, "variable_config_"+variable_config_number + ".p" )
+    fixed_configs_path = os.path.join(base_directory, "../fixed_config.p")
+
+    fixed_configs = pickle.load( open(fixed_configs_path, "rb" ) )
+    variable_configs = pickle.load( open(variable_configs_path, "rb" ) )
+
+    all_configs = {}
+
+    for key in fixed_configs.keys():
+        all_configs[key] = fixed_configs[key]
+
+    for key in variable_configs.keys():
+        all_configs[key] = variable_configs[key]
+
+    n_actors = all_configs["n_actors"]
+    weight_broadcast_freq = all_configs.get("actor_weight_update_freq", 1000)
+
+    # -------------------------------------------------------------------------------------------
+
+    env = build_env(all_configs, None)
+
+    initial_weights_file = os.path.join(variable_configs_folder, "initial_dqn_weights.h5f")
+    memory_directory = os.path.join(variable_configs_folder, "memory")
+    continuing = os.path.exists(initial_weights_file)
+
+    if continuing:
+      memory = load_compact_memory(memory_directory)
+    else:
+      if all_configs["deduplicated_memory"]:
+        memory_volume_depth = all_configs["volume_depth"]
+      else:
+        memory_volume_depth = None
+      if all_configs["prioritized_replay"]:
+        memory = PrioritizedCompactMemory(limit=all_configs["buffer_size"], window_length=1, volume_depth=memory_volume_depth,
+                                          beta_annealing_steps=all_configs["max_timesteps"])
+      else:
+        memory = CompactSequentialMemory(limit=all_configs["buffer_size"], window_length=1, volume_depth=memory_volume_depth)
+
+    model = build_convolutional_nn(all_configs["c_layers"],all_configs["ff_layers"], env.observation_space.shape, env.num_actions)
+    policy = LinearAnnealedPolicy(EpsGreedyQPolicy(masked_greedy=all_configs["masked_greedy"]),
+        attr='eps', value_max=all_configs["max_eps"],
+        value_min=all_configs["final_eps"],
+        value_test=0.0,
+        nb_steps=all_configs["exploration_fraction"])
+    test_policy = GreedyQPolicy(masked_greedy=True)
+
+    # Prioritized replay needs an agent which weights its updates, and refreshes the priorities from them
+    if isinstance(memory, PrioritizedCompactMemory):
+      agent_class = prioritized_dqn_agent(DQNAgent)
+    else:
+      agent_class = DQNAgent
+
+    dqn = agent_class(model=model,
+                      nb_actions=env.num_actions,
+                      memory=memory,
+                      nb_steps_warmup=all_configs["learning_starts"],
+                      target_model_update=all_configs["target_network_update_freq"],
+                      policy=policy,
+                      test_policy = test_policy,
+                      gamma = all_configs["gamma"],
+                      enable_dueling_network=all_configs["dueling"])
+
+    dqn.compile(Adam(lr=all_configs["learning_rate"]))
+
+    if continuing:
+      dqn.model.load_weights(initial_weights_file)
+      dqn.update_target_model_hard()
+
+    # -------------------------------------------------------------------------------------------
+
+    now = datetime.datetime.now()
+    started_file = os.path.join(variable_configs_folder,"started_at.p")
+    pickle.dump(now, open(started_file, "wb" ) )
+
+    context = multiprocessing.get_context("spawn")
+
+    weights = dqn.model.get_weights()
+    weight_shapes = [np.shape(weight) for weight in weights]
+    shared_weights = context.RawArray("f", int(sum(np.size(weight) for weight in weights)))
+    weights_lock = context.Lock()
+    shared_step = context.RawValue("q", 0)
+    publish_weights(weights, shared_weights, weights_lock, shared_step, 0)
+
+    # Each actor explores a little less than the previous one, the first one following the configured schedule
+    transition_queue = context.Queue(maxsize=4*n_actors)
+    actors = []
+    for actor_index in range(n_actors):
+        final_eps = all_configs["final_eps"]**(1 + actor_index/max(1, n_actors - 1))
+        actor = context.Process(target=run_actor,
+            args=(actor_index, all_configs, base_directory, final_eps, weight_shapes, shared_weights, weights_lock, shared_step,
+                  transition_queue, random.randrange(2**31)))
+        actor.daemon = True
+        actor.start()
+        actors.append(actor)
+
+    # -------------------------------------------------------------------------------------------
+
+    logging_path = os.path.join(variable_configs_folder,"training_history.json")
+    training_history = {"step": [], "episode_lifetimes_rolling_avg": []}
+    episode_lifetimes = deque(maxlen=all_configs["rolling_average_length"])
+    nb_episodes = 0
+
+    dqn.training = True
+    dqn.step = 0
+    keep_training = True
+    while keep_training:
+
+        # Rather than waiting forever, stop if the actors have died
+        try:
+            actor_index, transitions, new_lifetimes = transition_queue.get(timeout=60)
+        except queue.Empty:
+            for actor in actors:
+                if not actor.is_alive():
+                    raise Exception("actor process {} exited with code {}!".format(actors.index(actor), actor.exitcode))
+            continue
+
+        # Feed the (whole episodes of) transitions to the agent exactly as keras-rl does during fit
+        for observation, action, reward, done in transitions:
+            dqn.recent_observation = observation
+            dqn.recent_action = action
+            dqn.backward(reward, terminal=done)
+            dqn.step += 1
+
+            if dqn.step % weight_broadcast_freq == 0:
+                publish_weights(dqn.model.get_weights(), shared_weights, weights_lock, shared_step, dqn.step)
+
+        for lifetime in new_lifetimes:
+            episode_lifetimes.append(lifetime)
+            nb_episodes += 1
+            if nb_episodes % all_configs["print_freq"] == 0:
+                rolling_average = float(np.mean(episode_lifetimes))
+                training_history["step"].append(dqn.step)
+                training_history["episode_lifetimes_rolling_avg"].append(rolling_average)
+                json.dump(training_history, open(logging_path, "w"))
+                print("step", dqn.step, "episodes", nb_episodes, "rolling average lifetime", rolling_average)
+
+        if dqn.step >= all_configs["max_timesteps"]:
+            keep_training = False
+        elif dqn.step >= all_configs["exploration_fraction"] and len(episode_lifetimes) == all_configs["rolling_average_length"]:
+            if np.mean(episode_lifetimes) > all_configs["success_threshold"]:
+                keep_training = False
+
+    for actor in actors:
+        actor.terminate()
+
+    # -------------------------------------------------------------------------------------------
+
+    dqn.memory.save(memory_directory)
+    final_weights_file = os.path.join(variable_configs_folder, "final_dqn_weights.h5f")
+    dqn.save_weights(final_weights_file, overwrite=True)
+
+    # -------------------------------------------------------------------------------------------
+    # The trained agent is evaluated over a sweep of error rates by Single_Point_Evaluation_Script.py, which is submitted as a
+    # separate job (see evaluation_script.sh), so that evaluation does not take up any of the training time.
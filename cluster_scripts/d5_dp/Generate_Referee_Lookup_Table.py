@@ -0,0 +1,36 @@
+# ------------ This script precomputes the predictions of the referee decoder into a lookup table ----------------
+#
+# usage: python Generate_Referee_Lookup_Table.py [max_weight]
+#
+# The static decoder in this (base) directory is evaluated on every perfect syndrome - or if max_weight is given, on every syndrome
+# with at most max_weight violated stabilizers - and the predictions are saved into "./referee_table/". If this directory is present
+# the training scripts use the table as the referee, instead of the Keras static decoder.
+
+import os
+import sys
+import pickle
+
+from keras.models import load_model
+
+from Function_Library import *
+
+cwd = os.getcwd()
+
+# ------------ Fetch the code distance and the referee decoder ------------------------------------------------
+
+fixed_configs = pickle.load( open(os.path.join(cwd, "fixed_config.p"), "rb" ) )
+static_decoder = load_model(os.path.join(cwd, "static_decoder"))
+
+if len(sys.argv) > 1:
+    max_weight = int(sys.argv[1])
+else:
+    max_weight = None
+
+# ------------ Generate and save the table -------------------------------------------------------------------
+
+keys, classes, num_classes = generate_referee_table(static_decoder, fixed_configs["d"], max_weight)
+
+referee_table_directory = os.path.join(cwd, "referee_table")
+save_referee_table(referee_table_directory, fixed_configs["d"], keys, classes, num_classes)
+
+print("saved the predictions for", len(keys), "syndromes into", referee_table_directory)
@@ -49,8 +49,12 @@ for key in fixed_configs.keys():
 for key in variable_configs.keys():
     all_configs[key] = variable_configs[key]
 
-if fixed_configs["static_decoder"]:
-  static_decoder = load_model(os.path.join(base_directory, "../static_decoder"))
+if fixed_configs["static_decoder"] and os.path.exists(os.path.join(base_directory, "../referee_table")):
+  static_decoder = RefereeLookupTable(os.path.join(base_directory, "../referee_table"))
+  if not static_decoder.dense:
+    static_decoder.fallback_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
+elif fixed_configs["static_decoder"]:
+  static_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
 else:
   static_decoder = None
 
@@ -100,11 +104,21 @@ env = Surface_Code_Environment_Multi_Decoding_Cycles(d=all_configs["d"],
     error_model=all_configs["error_model"], 
     use_Y=all_configs["use_Y"], 
     volume_depth=all_configs["volume_depth"],
-    static_decoder=static_decoder)
+    static_decoder=static_decoder,
+    fast_forward=all_configs.get("fast_forward", True))
 # -------------------------------------------------------------------------------------------
 
 model = build_convolutional_nn(all_configs["c_layers"],all_configs["ff_layers"], env.observation_space.shape, env.num_actions)
-memory = SequentialMemory(limit=all_configs["buffer_size"], window_length=1)
+if all_configs["deduplicated_memory"]:
+  memory_volume_depth = all_configs["volume_depth"]
+else:
+  memory_volume_depth = None
+
+if all_configs["prioritized_replay"]:
+  memory = PrioritizedCompactMemory(limit=all_configs["buffer_size"], window_length=1, volume_depth=memory_volume_depth,
+                                    beta_annealing_steps=all_configs["max_timesteps"])
+else:
+  memory = CompactSequentialMemory(limit=all_configs["buffer_size"], window_length=1, volume_depth=memory_volume_depth)
 policy = LinearAnnealedPolicy(EpsGreedyQPolicy(masked_greedy=all_configs["masked_greedy"]), 
     attr='eps', value_max=all_configs["max_eps"], 
     value_min=all_configs["final_eps"], 
@@ -114,15 +128,21 @@ test_policy = GreedyQPolicy(masked_greedy=True)
 
 # ------------------------------------------------------------------------------------------
 
-dqn = DQNAgent(model=model, 
-               nb_actions=env.num_actions, 
-               memory=memory, 
-               nb_steps_warmup=all_configs["learning_starts"], 
-               target_model_update=all_configs["target_network_update_freq"], 
-               policy=policy,
-               test_policy = test_policy,
-               gamma = all_configs["gamma"],
-               enable_dueling_network=all_configs["dueling"])  
+# Prioritized replay needs an agent which weights its updates, and refreshes the priorities from them
+if isinstance(memory, PrioritizedCompactMemory):
+  agent_class = prioritized_dqn_agent(DQNAgent)
+else:
+  agent_class = DQNAgent
+
+dqn = agent_class(model=model, 
+                  nb_actions=env.num_actions, 
+                  memory=memory, 
+                  nb_steps_warmup=all_configs["learning_starts"], 
+                  target_model_update=all_configs["target_network_update_freq"], 
+                  policy=policy,
+                  test_policy = test_policy,
+                  gamma = all_configs["gamma"],
+                  enable_dueling_network=all_configs["dueling"])  
 
 
 dqn.compile(Adam(lr=all_configs["learning_rate"]))
@@ -151,70 +171,12 @@ history = dqn.fit(env,
 
 # -------------------------------------------------------------------------------------------
 
-memory_file = os.path.join(variable_configs_folder,"memory.p")
-pickle.dump(dqn.memory, open(memory_file, "wb" ) )
+memory_directory = os.path.join(variable_configs_folder,"memory")
+dqn.memory.save(memory_directory)
 
 final_weights_file = os.path.join(variable_configs_folder, "final_dqn_weights.h5f")
 dqn.save_weights(final_weights_file, overwrite=True)
 
 # -------------------------------------------------------------------------------------------
-
-model = build_convolutional_nn(all_configs["c_layers"],all_configs["ff_layers"], env.observation_space.shape, env.num_actions)
-memory = SequentialMemory(limit=all_configs["buffer_size"], window_length=1)
-policy = GreedyQPolicy(masked_greedy=True)
-test_policy = GreedyQPolicy(masked_greedy=True)
-
-# ------------------------------------------------------------------------------------------
-
-dqn = DQNAgent(model=model, 
-               nb_actions=env.num_actions, 
-               memory=memory, 
-               nb_steps_warmup=all_configs["learning_starts"], 
-               target_model_update=all_configs["target_network_update_freq"], 
-               policy=policy,
-               test_policy=test_policy,
-               gamma = all_configs["gamma"],
-               enable_dueling_network=all_configs["dueling"])  
-
-
-dqn.compile(Adam(lr=all_configs["learning_rate"]))
-dqn.model.load_weights(final_weights_file)
-
-# -------------------------------------------------------------------------------------------
-
-trained_at = all_configs["p_phys"]
-num_to_test = 20
-error_rates = [j*0.001 for j in range(1,num_to_test + 1)]
-thresholds = [1/p for p in error_rates]
-nb_test_episodes = all_configs["testing_length"]
-all_results = {}
-
-
-keep_evaluating = True
-count = 0
-while keep_evaluating:
-
-  err_rate = error_rates[count]
-  env.p_phys = err_rate
-  env.p_meas = err_rate
-
-  dict_key = str(err_rate)[:5]
-
-
-  testing_history = dqn.test(env,nb_episodes = nb_test_episodes, visualize=False, verbose=2, interval=10, single_cycle=False)
-  results = testing_history.history["episode_lifetimes_rolling_avg"]
-  final_result = results[-1:][0]
-  all_results[dict_key] = final_result
-
-  if abs(trained_at - err_rate) < 1e-6:
-    results_file = os.path.join(variable_configs_folder,"results.p")
-    pickle.dump(results, open(results_file, "wb" ))
-
-  to_beat = thresholds[count]
-  if final_result < to_beat or count == (num_to_test - 1):
-    keep_evaluating = False
-
-  count += 1
-
-all_results_file = os.path.join(variable_configs_folder,"all_results.p")
-pickle.dump(all_results, open(all_results_file, "wb" ))
+# The trained agent is evaluated over a sweep of error rates by ../Single_Point_Evaluation_Script.py, which is submitted as a
+# separate job (see evaluation_script.sh), so that evaluation does not take up any of the training time.
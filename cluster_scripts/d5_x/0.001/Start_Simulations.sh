@@ -2,5 +2,6 @@
 
 for d in */ ; do
     script_path="./${d}simulation_script.sh"
-    sbatch $script_path
-done
\ No newline at end of file
+    job_id=$(sbatch --parsable $script_path)
+    sbatch --dependency=afterok:$job_id "./${d}evaluation_script.sh"
+done
@@ -38,11 +38,16 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
     :param: use_Y: A boolean indicating whether the environment accepts Y Pauli flips as actions
     :param: volume_depth: The number of sequential syndrome measurements performed when generating a new syndrome volume.
     :param: static_decoder: A homology class predicting decoder for perfect syndromes.
+    :param: packed_state: A boolean indicating whether the hidden state should be stored in the bit-packed symplectic representation,
+                          in which case it is held in hidden_state_bits = [x_bits, z_bits] rather than in hidden_state.
+    :param: fast_forward: A boolean indicating whether stretches of error free syndrome volumes following a trivial syndrome are 
+                          skipped in a single draw, with the skipped rounds added to the lifetime, rather than simulated one by one.
 
     """
 
 
-    def __init__(self, d=5, p_phys=0.01, p_meas=0.01, error_model="DP", use_Y=True, volume_depth=3, static_decoder=None):
+    def __init__(self, d=5, p_phys=0.01, p_meas=0.01, error_model="DP", use_Y=True, volume_depth=3, static_decoder=None, packed_state=False, 
+                 fast_forward=True):
 
         self.d = d
         self.p_phys = p_phys
@@ -51,6 +56,8 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
         self.use_Y = use_Y
         self.volume_depth = volume_depth
         self.static_decoder = static_decoder
+        self.packed_state = packed_state
+        self.fast_forward = fast_forward
 
         self.n_action_layers = 0
         if error_model == "X":
@@ -68,10 +75,14 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
 
         self.identity_index = self.num_actions -1
         self.identity_indicator = self.generate_identity_indicator(self.d)
+        self.syndrome_background = self.generate_syndrome_background(self.d)
 
         self.qubits = generateSurfaceCodeLattice(self.d)
         self.qubit_stabilizers = self.get_stabilizer_list(self.qubits, self.d)  
         self.qubit_neighbours = self.get_qubit_neighbour_list(self.d) 
+        if self.packed_state:
+            self.syndrome_masks = generate_packed_syndrome_masks(self.qubits)
+            self.logical_masks = generate_packed_logical_masks(self.d)
         self.completed_actions = np.zeros(self.num_actions, int)
         
     
@@ -84,6 +95,7 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
         self.action_space = gym.spaces.Discrete(self.num_actions)
 
         self.hidden_state = np.zeros((self.d, self.d), int)
+        self.hidden_state_bits = [0, 0]
         self.current_true_syndrome = np.zeros((self.d+1, self.d+1), int)
         self.summed_syndrome_volume = None         
         self.board_state = np.zeros((self.volume_depth + self.n_action_layers, 2 * self.d + 1, 2 * self.d + 1),int)
@@ -133,14 +145,14 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
 
         # 1) Apply the action to the hidden state
         action_lattice = index_to_move(self.d, action, self.error_model, self.use_Y)
-        self.hidden_state = obtain_new_error_configuration(self.hidden_state, action_lattice)
+        self.apply_to_hidden_state(action_lattice)
 
         # 2) Calculate the reward
-        self.current_true_syndrome = generate_surface_code_syndrome_NoFT_efficient(self.hidden_state, self.qubits)
+        self.current_true_syndrome = self.generate_true_syndrome()
         current_true_syndrome_vector = np.reshape(self.current_true_syndrome,(self.d+1)**2) 
         num_anyons = np.sum(self.current_true_syndrome)
 
-        correct_label = generate_one_hot_labels_surface_code(self.hidden_state, self.error_model)
+        correct_label = self.generate_correct_label()
         decoder_label = self.static_decoder.predict(np.array([current_true_syndrome_vector]), batch_size=1, verbose=0)
 
         reward = 0
@@ -154,32 +166,15 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
         # 3) If necessary, apply multiple errors and obtain an error volume - ensure that a non-trivial volume is generated
         if done_identity:
 
-            trivial_volume = True
-            while trivial_volume: 
-                self.summed_syndrome_volume = np.zeros((self.d + 1, self.d + 1), int)
-                faulty_syndromes = []
-                for j in range(self.volume_depth):
-                    error = generate_error(self.d, self.p_phys, self.error_model)
-                    if int(np.sum(error)!=0):
-                        self.hidden_state = obtain_new_error_configuration(self.hidden_state, error)
-                        self.current_true_syndrome = generate_surface_code_syndrome_NoFT_efficient(self.hidden_state, self.qubits)
-                    current_faulty_syndrome = generate_faulty_syndrome(self.current_true_syndrome, self.p_meas)
-                    faulty_syndromes.append(current_faulty_syndrome)
-                    self.summed_syndrome_volume += current_faulty_syndrome
-                    self.lifetime += 1
-
-                if int(np.sum(self.summed_syndrome_volume)) != 0:
-                    trivial_volume = False
-
-            for j in range(self.volume_depth):
-                self.board_state[j, :, :] = self.padding_syndrome(faulty_syndromes[j])
+            faulty_syndromes = self.generate_nontrivial_syndrome_volume()
+            self.board_state[:self.volume_depth, :, :] = self.padding_syndrome(faulty_syndromes)
 
 
             # reset the legal moves
             self.reset_legal_moves()
 
             # update the part of the state which shows the actions you have just taken
-            self.board_state[self.volume_depth:,:,:] = np.zeros((self.n_action_layers, 2 * self.d + 1, 2 * self.d + 1),int)
+            self.board_state[self.volume_depth:,:,:] = 0
 
 
         else:
@@ -196,9 +191,11 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
                                 self.legal_actions.add(neighbour + j*self.d**2)
 
                 
-            # update the board state to reflect the action thats been taken
-            for k in range(self.n_action_layers):
-                    self.board_state[self.volume_depth + k, :, :] = self.padding_actions(self.completed_actions[k * self.d ** 2:(k + 1) * self.d ** 2])
+                # update the board state to reflect the action thats been taken - only the acted on cell changes
+                action_layer = int(action / self.d**2)
+                row = int(acted_qubit / self.d)
+                col = int(acted_qubit % self.d)
+                self.board_state[self.volume_depth + action_layer, 2*row+1, 2*col+1] = self.completed_actions[action]
 
 
         return self.board_state, reward, self.done, {}
@@ -209,31 +206,100 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
         """
 
         self.done = False
-        self.hidden_state = np.zeros((self.d, self.d), int)
+        if self.packed_state:
+            self.hidden_state = None
+        else:
+            self.hidden_state = np.zeros((self.d, self.d), int)
+        self.hidden_state_bits = [0, 0]
         self.current_true_syndrome = np.zeros((self.d+1, self.d+1), int) 
         self.board_state = np.zeros((self.volume_depth + self.n_action_layers, 2 * self.d + 1, 2 * self.d + 1),int)
         
-        trivial_volume = True
-        while trivial_volume:
-            self.summed_syndrome_volume = np.zeros((self.d + 1, self.d + 1), int)
-            faulty_syndromes = []
-            for j in range(self.volume_depth):
-                error = generate_error(self.d, self.p_phys, self.error_model)
-                if int(np.sum(error)) != 0:
-                    self.hidden_state = obtain_new_error_configuration(self.hidden_state, error)
-                    self.current_true_syndrome = generate_surface_code_syndrome_NoFT_efficient(self.hidden_state, self.qubits)
-                current_faulty_syndrome = generate_faulty_syndrome(self.current_true_syndrome, self.p_meas)
-                faulty_syndromes.append(current_faulty_syndrome)
-                self.summed_syndrome_volume += current_faulty_syndrome
-                self.lifetime += 1
+        faulty_syndromes = self.generate_nontrivial_syndrome_volume()
+
+        # update the board state to reflect the measured syndromes
+        self.board_state[:self.volume_depth, :, :] = self.padding_syndrome(faulty_syndromes)
+
 
+    def generate_nontrivial_syndrome_volume(self):
+        """
+        Apply error volumes to the hidden state until a non-trivial volume of faulty syndromes is obtained, and return it. 
+
+        Whenever the current true syndrome is trivial, a volume without any physical or measurement error has a trivial faulty 
+        syndrome. Rather than generating and rejecting such volumes one by one, the number of error free volumes is sampled directly, 
+        together with a volume conditioned on containing at least one error, so that the expected work does not depend on the error 
+        rates. The lifetime includes the skipped volumes. This fast forwarding can be switched off with the fast_forward option.
+        """
+
+        while True:
+            if np.any(self.current_true_syndrome) or not self.fast_forward:
+                faulty_syndromes = self.generate_syndrome_volume()
+            else:
+                errors, measurement_errors, n_skipped = sample_first_event_volumes(self.d, self.p_phys, self.p_meas, 
+                                                                                   self.error_model, self.volume_depth, 1)
+                self.lifetime += int(n_skipped[0])*self.volume_depth
+                faulty_syndromes = self.generate_syndrome_volume(errors[0], measurement_errors[0])
+
+            self.summed_syndrome_volume = np.sum(faulty_syndromes, axis=0)
             if int(np.sum(self.summed_syndrome_volume)) != 0:
-                trivial_volume = False
+                return faulty_syndromes
 
-        # update the board state to reflect the measured syndromes
-        for j in range(self.volume_depth):
-            self.board_state[j, :, :] = self.padding_syndrome(faulty_syndromes[j])
+    def generate_syndrome_volume(self, errors=None, measurement_errors=None):
+        """
+        Apply volume_depth error layers to the hidden state, and return the (volume_depth, d+1, d+1) volume of faulty syndromes
+        measured after each layer. The lifetime is updated accordingly. The error layers and measurement errors can optionally 
+        be given, otherwise they are sampled.
+        """
+
+        if errors is None:
+            errors = generate_error_batch(self.d, self.p_phys, self.error_model, self.volume_depth)
+
+        if self.packed_state:
+            true_syndromes = np.zeros((self.volume_depth, self.d + 1, self.d + 1), int)
+            for j in range(self.volume_depth):
+                if int(np.sum(errors[j])) != 0:
+                    self.apply_to_hidden_state(errors[j])
+                    self.current_true_syndrome = self.generate_true_syndrome()
+                true_syndromes[j] = self.current_true_syndrome
+        else:
+            # The hidden state after each layer, and the corresponding syndromes, are obtained all at once
+            layer_states = obtain_new_error_configuration(self.hidden_state, np.bitwise_xor.accumulate(errors, axis=0))
+            true_syndromes = generate_surface_code_syndrome_NoFT_efficient(layer_states, self.qubits)
+            self.hidden_state[:, :] = layer_states[-1]
+            self.current_true_syndrome = true_syndromes[-1]
+
+        self.lifetime += self.volume_depth
+
+        return generate_faulty_syndrome(true_syndromes, self.p_meas, measurement_errors)
+
+    def apply_to_hidden_state(self, lattice):
+        """
+        Apply the Paulis of the given lattice (an error or a correction) to the hidden state
+        """
+
+        if self.packed_state:
+            x_bits, z_bits = pack_error_configuration(lattice)
+            self.hidden_state_bits[0] ^= x_bits
+            self.hidden_state_bits[1] ^= z_bits
+        else:
+            obtain_new_error_configuration(self.hidden_state, lattice, in_place=True)
+
+    def generate_true_syndrome(self):
+        """
+        Generate the perfect syndrome of the current hidden state
+        """
+
+        if self.packed_state:
+            return generate_packed_syndrome(self.hidden_state_bits[0], self.hidden_state_bits[1], self.syndrome_masks, self.d)
+        return generate_surface_code_syndrome_NoFT_efficient(self.hidden_state, self.qubits)
+
+    def generate_correct_label(self):
+        """
+        Generate the one-hot homology class label of the current hidden state
+        """
 
+        if self.packed_state:
+            return generate_one_hot_labels_packed(self.hidden_state_bits[0], self.hidden_state_bits[1], self.logical_masks, self.error_model)
+        return generate_one_hot_labels_surface_code(self.hidden_state, self.error_model)
 
     def reset_legal_moves(self):
         """
@@ -272,44 +338,25 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
 
     def padding_syndrome(self, syndrome_in):
         """
-        Pad a syndrome into the required embedding
+        Pad a syndrome into the required embedding. A whole syndrome volume can be padded at once.
         """
 
-        syndrome_out = np.zeros((2*self.d+1, 2*self.d+1),int)
-        
-        for x in range( 2*self.d+1 ):
-            for y in range( 2*self.d+1 ):
+        syndrome_out = np.empty(np.shape(syndrome_in)[:-2] + self.syndrome_background.shape, int)
+        syndrome_out[...] = self.syndrome_background
 
-                #label the boundaries and corners
-                if x==0 or x== 2*self.d:
-                    if y%2 == 1:
-                        syndrome_out[x,y] = 1
+        # copy in the syndrome
+        syndrome_out[..., ::2, ::2] = syndrome_in
 
-                if y==0 or y== 2*self.d:
-                    if x%2 == 1:
-                        syndrome_out[x,y] = 1
-
-                if x%2 == 0 and y%2 == 0: 
-                    # copy in the syndrome
-                    syndrome_out[ x, y ] = syndrome_in[ int(x/2), int(y/2) ]
-                elif x%2 == 1 and y%2 == 1:
-                    if (x+y)%4 == 0:
-                        #label the stabilizers
-                        syndrome_out[x,y] = 1
         return syndrome_out
         
     def padding_actions(self,actions_in):
         """
-        Pad an action history for a single type of Pauli flip into the required embedding.
+        Pad an action history for a single type of Pauli flip into the required embedding. Action histories for multiple
+        types of Pauli flips can be padded at once, by giving an (n_action_layers, d**2) array.
         """
-        actions_out = np.zeros( ( 2*self.d+1, 2*self.d+1 ),int )
+        actions_out = np.zeros( np.shape(actions_in)[:-1] + ( 2*self.d+1, 2*self.d+1 ),int )
 
-        for action_index, action_taken in enumerate( actions_in ):
-            if action_taken:
-                row = int( action_index / self.d )
-                col = int( action_index % self.d )
-
-                actions_out[ int( 2*row+1 ), int( 2*col+1 ) ] = 1
+        actions_out[..., 1::2, 1::2] = np.reshape( np.asarray(actions_in) != 0, np.shape(actions_in)[:-1] + ( self.d, self.d ) )
 
         return actions_out
 
@@ -371,6 +418,31 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
 
         return neighbour_list
 
+    def generate_syndrome_background(self, d):
+        """"
+        A simple helper function to generate the fixed part of the syndrome embedding, in which the boundaries and the stabilizers are labelled.
+        """
+
+        syndrome_background = np.zeros((2*d+1, 2*d+1),int)
+        
+        for x in range( 2*d+1 ):
+            for y in range( 2*d+1 ):
+
+                #label the boundaries and corners
+                if x==0 or x== 2*d:
+                    if y%2 == 1:
+                        syndrome_background[x,y] = 1
+
+                if y==0 or y== 2*d:
+                    if x%2 == 1:
+                        syndrome_background[x,y] = 1
+
+                if x%2 == 1 and y%2 == 1:
+                    if (x+y)%4 == 0:
+                        #label the stabilizers
+                        syndrome_background[x,y] = 1
+        return syndrome_background
+
     def generate_identity_indicator(self, d):
         """"
         A simple helper function to generate the array that will be added to the action history to indicate that an identity has been performed.
@@ -385,6 +457,275 @@ class Surface_Code_Environment_Multi_Decoding_Cycles():
         return identity_indicator
 
 
+#---------- (2) --------------------------------------------------------------------------------------------------------------------------------------
+
+class VectorizedSurfaceCodeEnv():
+    """
+    A batch of n_envs independent copies of Surface_Code_Environment_Multi_Decoding_Cycles, stepped simultaneously on stacked arrays.
+    In particular:
+
+        - error sampling, syndrome generation and the referee/static decoder calls are performed once per step for all episodes
+        - the observation and action spaces are those of a single Surface_Code_Environment_Multi_Decoding_Cycles
+        - episodes which reach a terminal state are automatically reset
 
+    step returns the stacked visible states, and for every episode that finished on that step the corresponding entry of infos
+    contains the final visible state ("terminal_observation") and the qubit lifetime of that episode ("lifetime").
 
 
+    Attributes
+    ----------
+
+    :param: n_envs: The number of episodes to run in parallel
+    :param: d: The code distance
+    :param: p_phys: The physical error probability on a single physical data qubit
+    :param: p_meas: The measurement error probability on a single syndrome bit
+    :param: error_model: A string in ["X, DP"]
+    :param: use_Y: A boolean indicating whether the environment accepts Y Pauli flips as actions
+    :param: volume_depth: The number of sequential syndrome measurements performed when generating a new syndrome volume.
+    :param: static_decoder: A homology class predicting decoder for perfect syndromes.
+    :param: fast_forward: A boolean indicating whether stretches of error free syndrome volumes following a trivial syndrome are skipped.
+
+    """
+
+    def __init__(self, n_envs=64, d=5, p_phys=0.01, p_meas=0.01, error_model="DP", use_Y=True, volume_depth=3, static_decoder=None, 
+                 fast_forward=True):
+
+        self.n_envs = n_envs
+        self.d = d
+        self.p_phys = p_phys
+        self.p_meas = p_meas
+        self.error_model = error_model
+        self.use_Y = use_Y
+        self.volume_depth = volume_depth
+        self.static_decoder = static_decoder
+        self.fast_forward = fast_forward
+
+        # A single environment provides the lattice, the spaces and the embeddings shared by all the episodes
+        self.single_env = Surface_Code_Environment_Multi_Decoding_Cycles(d=d, p_phys=p_phys, p_meas=p_meas, error_model=error_model, 
+                                                                         use_Y=use_Y, volume_depth=volume_depth, static_decoder=static_decoder)
+
+        self.num_actions = self.single_env.num_actions
+        self.n_action_layers = self.single_env.n_action_layers
+        self.identity_index = self.single_env.identity_index
+        self.qubits = self.single_env.qubits
+        self.qubit_neighbours = self.single_env.qubit_neighbours
+        self.observation_space = self.single_env.observation_space
+        self.action_space = self.single_env.action_space
+
+        H_X, H_Z = get_parity_check_matrices(self.qubits)
+        self.qubit_stabilizer_adjacency = (H_X + H_Z).T != 0
+
+        self.hidden_states = np.zeros((self.n_envs, self.d, self.d), int)
+        self.current_true_syndromes = np.zeros((self.n_envs, self.d+1, self.d+1), int)
+        self.summed_syndrome_volumes = np.zeros((self.n_envs, self.d+1, self.d+1), int)
+        self.board_states = np.zeros((self.n_envs, self.volume_depth + self.n_action_layers, 2 * self.d + 1, 2 * self.d + 1),int)
+
+        self.completed_actions = np.zeros((self.n_envs, self.num_actions), int)
+        self.acted_on_qubits = [set() for j in range(self.n_envs)]
+        self.legal_actions = [set() for j in range(self.n_envs)]
+        self.dones = np.zeros(self.n_envs, bool)
+        self.lifetimes = np.zeros(self.n_envs, int)
+
+    def reset(self):
+        """
+        Reset all the episodes.
+
+        :return: self.board_states: The (n_envs, ...) stack of new visible states
+        """
+
+        self.reset_episodes(np.arange(self.n_envs))
+
+        return self.board_states
+
+    def reset_episodes(self, indices):
+        """
+        Reset the given episodes, each with a new non-trivial syndrome volume.
+
+        :param: indices: An array of the indices of the episodes to reset
+        """
+
+        self.dones[indices] = False
+        self.lifetimes[indices] = 0
+        self.hidden_states[indices] = 0
+        self.current_true_syndromes[indices] = 0
+        self.board_states[indices] = 0
+
+        self.new_syndrome_volumes(indices)
+
+    def step(self, actions):
+        """
+        Given an action for every episode, this method executes the logic of the environment for all episodes at once.
+
+        :param: actions: An array of n_envs integer actions
+        :return: self.board_states: The (n_envs, ...) stack of visible states - reset states for the episodes that just finished
+        :return: rewards: The reward for each action
+        :return: dones: The boolean terminal state indicator of each episode
+        :return: infos: A list of dictionaries, containing the terminal observation and lifetime of each episode that just finished
+        """
+
+        actions = np.asarray(actions, int)
+        all_envs = np.arange(self.n_envs)
+        done_identity = np.logical_or(actions == self.identity_index, self.completed_actions[all_envs, actions] == 1)
+
+        # 1) Apply the actions to the hidden states
+        acting = np.flatnonzero(actions != self.identity_index)
+        acted_qubits = actions[acting] % self.d**2
+        move_types = np.floor_divide(actions[acting], self.d**2) + 1
+        if self.error_model == "DP" and not self.use_Y:
+            move_types[move_types == 2] = 3
+        rows = np.floor_divide(acted_qubits, self.d)
+        cols = np.mod(acted_qubits, self.d)
+        self.hidden_states[acting, rows, cols] = np.bitwise_xor(self.hidden_states[acting, rows, cols], move_types)
+
+        # 2) Calculate the rewards - with a single call to the referee decoder for all the episodes
+        self.current_true_syndromes = generate_surface_code_syndrome_NoFT_efficient(self.hidden_states, self.qubits)
+        true_syndrome_vectors = np.reshape(self.current_true_syndromes, (self.n_envs, (self.d+1)**2))
+        num_anyons = np.sum(true_syndrome_vectors, axis=1)
+
+        correct_labels = np.argmax(generate_one_hot_labels_surface_code(self.hidden_states, self.error_model), axis=1)
+        decoder_labels = np.argmax(self.static_decoder.predict(true_syndrome_vectors, batch_size=self.n_envs, verbose=0), axis=1)
+
+        rewarded = np.logical_and(correct_labels == 0, num_anyons == 0)
+        rewards = rewarded.astype(float)
+        self.dones = np.logical_and(np.logical_not(rewarded), decoder_labels != correct_labels)
+
+        # 3) Where necessary, apply multiple errors and obtain non-trivial error volumes
+        identities = np.flatnonzero(done_identity)
+        if len(identities) > 0:
+            self.new_syndrome_volumes(identities)
+
+        for j in np.flatnonzero(np.logical_not(done_identity)):
+            action = actions[j]
+            self.completed_actions[j, action] = 1
+
+            acted_qubit = action%(self.d**2)
+            if acted_qubit not in self.acted_on_qubits[j]:
+                self.acted_on_qubits[j].add(acted_qubit)
+                for neighbour in self.qubit_neighbours[acted_qubit]:
+                        for k in range(self.n_action_layers):
+                            self.legal_actions[j].add(neighbour + k*self.d**2)
+
+            action_layer = int(action / self.d**2)
+            self.board_states[j, self.volume_depth + action_layer, 2*int(acted_qubit / self.d)+1, 2*int(acted_qubit % self.d)+1] = 1
+
+        # 4) Automatically reset the finished episodes
+        dones = np.copy(self.dones)
+        infos = [{} for j in range(self.n_envs)]
+        finished = np.flatnonzero(dones)
+        for j in finished:
+            infos[j]["terminal_observation"] = np.copy(self.board_states[j])
+            infos[j]["lifetime"] = int(self.lifetimes[j])
+        if len(finished) > 0:
+            self.reset_episodes(finished)
+
+        return self.board_states, rewards, dones, infos
+
+    def new_syndrome_volumes(self, indices):
+        """
+        Apply error volumes to the given episodes, until each of them has a non-trivial syndrome volume, and update their visible 
+        states and legal moves accordingly. As in the single environment, the error free volumes of episodes with a trivial 
+        current syndrome are skipped at once.
+
+        :param: indices: An array of the indices of the episodes which require a new syndrome volume
+        """
+
+        remaining = np.asarray(indices, int)
+        while len(remaining) > 0:
+            errors = generate_error_batch(self.d, self.p_phys, self.error_model, len(remaining)*self.volume_depth)
+            errors = np.reshape(errors, (len(remaining), self.volume_depth, self.d, self.d))
+            measurement_errors = np.logical_and(np.random.rand(len(remaining), self.volume_depth, self.d + 1, self.d + 1) < self.p_meas, 
+                                                get_stabilizer_mask(self.d))
+
+            quiet = np.logical_and(np.logical_not(np.any(self.current_true_syndromes[remaining], axis=(1,2))), self.fast_forward)
+            if np.any(quiet):
+                errors[quiet], measurement_errors[quiet], n_skipped = sample_first_event_volumes(self.d, self.p_phys, self.p_meas, 
+                                                                                   self.error_model, self.volume_depth, int(np.sum(quiet)))
+                self.lifetimes[remaining[quiet]] += n_skipped*self.volume_depth
+
+            layer_states = obtain_new_error_configuration(self.hidden_states[remaining, np.newaxis], np.bitwise_xor.accumulate(errors, axis=1))
+            true_syndromes = generate_surface_code_syndrome_NoFT_efficient(layer_states, self.qubits)
+            faulty_syndromes = generate_faulty_syndrome(true_syndromes, self.p_meas, measurement_errors)
+
+            self.hidden_states[remaining] = layer_states[:, -1]
+            self.current_true_syndromes[remaining] = true_syndromes[:, -1]
+            self.summed_syndrome_volumes[remaining] = np.sum(faulty_syndromes, axis=1)
+            self.lifetimes[remaining] += self.volume_depth
+
+            non_trivial = np.sum(faulty_syndromes, axis=(1,2,3)) != 0
+            completed = remaining[non_trivial]
+            self.board_states[completed, :self.volume_depth] = self.single_env.padding_syndrome(faulty_syndromes[non_trivial])
+            self.board_states[completed, self.volume_depth:] = 0
+            for j in completed:
+                self.reset_legal_moves(j)
+
+            remaining = remaining[np.logical_not(non_trivial)]
+
+    def reset_legal_moves(self, index):
+        """
+        Reset the legal moves of a single episode
+        """
+
+        self.completed_actions[index] = 0
+        self.acted_on_qubits[index] = set()
+        self.legal_actions[index] = set([self.identity_index])
+
+        summed_syndrome_vector = np.reshape(self.summed_syndrome_volumes[index], (self.d+1)**2)
+        legal_qubits = np.flatnonzero(np.any(self.qubit_stabilizer_adjacency[:, summed_syndrome_vector != 0], axis=1))
+        for j in range(self.n_action_layers):
+            for legal_qubit in legal_qubits:
+                self.legal_actions[index].add(int(legal_qubit) + j*self.d**2)
+
+
+#---------- (3) --------------------------------------------------------------------------------------------------------------------------------------
+
+def decode_batch(agent, syndrome_volumes, env):
+    """
+    Greedily decode many faulty syndrome volumes in lockstep. In every round a single batched evaluation of the Q-values is 
+    performed for all the volumes which are still being decoded, and for each of them the greedy action is taken. Decoding 
+    of a volume stops as soon as the agent chooses the identity, or a correction it has already suggested.
+
+    :param: agent: The trained agent - either a NumpyDQN, or a DQN agent whose (Keras) model provides predict_on_batch
+    :param: syndrome_volumes: An (n, volume_depth, d+1, d+1) array of faulty syndrome volumes
+    :param: env: A Surface_Code_Environment_Multi_Decoding_Cycles, which provides the embedding of the syndrome volumes and action history
+    :return: corrections: A list containing, for each volume, the list of suggested corrections
+    :return: steps: An array containing, for each volume, the number of Q-value evaluations performed
+    """
+
+    syndrome_volumes = np.asarray(syndrome_volumes)
+    n_volumes = syndrome_volumes.shape[0]
+
+    # Initialize the input states: embedded syndrome volumes and blank action histories
+    states = np.zeros((n_volumes, env.volume_depth + env.n_action_layers, 2*env.d + 1, 2*env.d + 1), np.float32)
+    states[:, :env.volume_depth] = env.padding_syndrome(syndrome_volumes)
+
+    corrections = [[] for j in range(n_volumes)]
+    steps = np.zeros(n_volumes, int)
+
+    still_decoding = np.arange(n_volumes)
+    while len(still_decoding) > 0:
+
+        # Fetch the suggested corrections
+        if hasattr(agent, "q_values"):
+            q_values = agent.q_values(states[still_decoding])
+        else:
+            q_values = agent.model.predict_on_batch(states[still_decoding])
+        actions = np.argmax(q_values, axis=1)
+        steps[still_decoding] += 1
+
+        # Determine which volumes have suggested a new correction
+        is_identity = actions == env.identity_index
+        action_layers = env.volume_depth + np.floor_divide(actions, env.d**2)
+        rows = 2*np.floor_divide(np.mod(actions, env.d**2), env.d) + 1
+        cols = 2*np.mod(np.mod(actions, env.d**2), env.d) + 1
+        action_layers[is_identity] = env.volume_depth
+        already_done = states[still_decoding, action_layers, rows, cols] == 1
+        new_correction = np.logical_and(np.logical_not(is_identity), np.logical_not(already_done))
+
+        # Update the input states to indicate the corrections that have been made
+        for j, action in zip(still_decoding[new_correction], actions[new_correction]):
+            corrections[j].append(int(action))
+        states[still_decoding[new_correction], action_layers[new_correction], rows[new_correction], cols[new_correction]] = 1
+
+        still_decoding = still_decoding[new_correction]
+
+    return corrections, steps
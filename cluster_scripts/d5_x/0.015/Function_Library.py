@@ -5,7 +5,12 @@
 # ----- (0) Imports --------------------------------------------------------------------------------------
 
 import random
+import os
+import pickle
+import itertools
+import math
 import numpy as np
+from collections import OrderedDict, deque, namedtuple
 
 # ---- (1) Functions -------------------------------------------------------------------------------------
 
@@ -51,6 +56,9 @@ def generateSurfaceCodeLattice(d):
     return qubits
 
 
+# The Pauli product table, up to phase, for [I,X,Y,Z] = [0,1,2,3]. Note that with this labelling ab = a XOR b.
+pauli_product_table = np.array([[0,1,2,3],[1,0,3,2],[2,3,0,1],[3,2,1,0]],np.uint8)
+
 def multiplyPaulis(a,b):
     """"
     A simple helper function for multiplying Pauli Matrices. Returns ab.
@@ -58,8 +66,7 @@ def multiplyPaulis(a,b):
     :param: b: an int in [0,1,2,3] representing [I,X,Y,Z]
     """
     
-    out = [[0,1,2,3],[1,0,3,2],[2,3,0,1],[3,2,1,0]]
-    return out[int(a)][int(b)]
+    return int(pauli_product_table[int(a),int(b)])
 
 
 # 2) Error generation
@@ -74,14 +81,43 @@ def generate_error(d,p_phys,error_model):
     :return: error: The error configuration
     """
     
+    return generate_error_batch(d,p_phys,error_model,1)[0]
+
+def generate_error_batch(d,p_phys,error_model,n):
+    """"
+    This function generates n independent error configurations, each via a single application of the specified error channel,
+    on a square dxd lattice. All the required random numbers are obtained from a single draw.
+    
+    :param: d: The code distance/lattice width and height (for surface/toric codes)
+    :param: p_phys: The physical error rate.
+    :param: error_model: A string in ["X", "DP", "IIDXZ"] indicating the desired error model.
+    :param: n: The number of error configurations to generate
+    :return: errors: An (n,d,d) array of error configurations
+    """
+
     if error_model == "X":
-        return generate_X_error(d,p_phys)
+        errors = (np.random.rand(n,d,d) < p_phys).astype(int)
+
     elif error_model == "DP":
-        return generate_DP_error(d,p_phys)
+        # Conditioned on an error occurring, rand/p_phys is uniform on [0,1), so it also selects the Pauli
+        rand = np.random.rand(n,d,d)
+        errors = np.zeros((n,d,d),int)
+        flipped = rand < p_phys
+        errors[flipped] = np.minimum((rand[flipped]*3/p_phys).astype(int), 2) + 1
+
     elif error_model == "IIDXZ":
-        return generate_IIDXZ_error(d,p_phys)
+        rand = np.random.rand(2,n,d,d) < p_phys
+        X_err = rand[0]
+        Z_err = rand[1]
+        errors = np.zeros((n,d,d),int)
+        errors[X_err] = 1
+        errors[Z_err] = 3
+        errors[np.logical_and(X_err,Z_err)] = 2
+
+    else:
+        raise Exception("error model "+str(error_model)+" is not currently supported!")
         
-    return error
+    return errors
 
 def generate_DP_error(d,p_phys):
     """"
@@ -92,15 +128,7 @@ def generate_DP_error(d,p_phys):
     :return: error: The error configuration
     """
 
-    error = np.zeros((d,d),int) 
-    for i in range(d): 
-        for j in range(d):
-            p = 0
-            if np.random.rand() < p_phys:
-                p = np.random.randint(1,4)
-                error[i,j] = p
-                
-    return error
+    return generate_error_batch(d,p_phys,"DP",1)[0]
 
 def generate_X_error(d,p_phys):
     """"
@@ -111,15 +139,7 @@ def generate_X_error(d,p_phys):
     :return: error: The error configuration
     """
     
-    
-    error = np.zeros((d,d),int) 
-    for i in range(d): 
-        for j in range(d):
-            p = 0
-            if np.random.rand() < p_phys:
-                error[i,j] = 1
-    
-    return error
+    return generate_error_batch(d,p_phys,"X",1)[0]
                 
 def generate_IIDXZ_error(d,p_phys):
     """"
@@ -130,115 +150,203 @@ def generate_IIDXZ_error(d,p_phys):
     :return: error: The error configuration
     """
     
-    error = np.zeros((d,d),int)
+    return generate_error_batch(d,p_phys,"IIDXZ",1)[0]
+
+parity_check_matrices = {}
+
+def generate_parity_check_matrices(qubits):
+    """"
+    This function generates the parity check matrices of the surface code described by the given qubit configuration.
+    Syndromes and error configurations are flattened row-wise, so that syndrome[a,b] corresponds to row a*(d+1)+b
+    and qubit (i,j) corresponds to column i*d+j.
+    
+    :param: qubits: The qubit configuration, as generated by generateSurfaceCodeLattice(d)
+    :return: H_X: A ((d+1)^2, d^2) array indicating which stabilizers are violated by an X flip on each qubit
+    :return: H_Z: A ((d+1)^2, d^2) array indicating which stabilizers are violated by a Z flip on each qubit
+    """
+
+    d = qubits.shape[0]
+    H_X = np.zeros(((d+1)**2, d**2),int)
+    H_Z = np.zeros(((d+1)**2, d**2),int)
+
     for i in range(d):
         for j in range(d):
-            X_err = False
-            Z_err = False
-            p = 0
-            if np.random.rand() < p_phys:
-                X_err = True
-                p = 1
-            if np.random.rand() < p_phys:
-                Z_err = True
-                p = 3
-            if X_err and Z_err:
-                p = 2
-
-            error[i,j] = p
-    
-    return error
+            for k in range(qubits.shape[2]):
+                a, b, stabilizer_type = qubits[i,j,k,:]
+                if stabilizer_type == 3:
+                    H_X[a*(d+1) + b, i*d + j] = 1
+                elif stabilizer_type == 1:
+                    H_Z[a*(d+1) + b, i*d + j] = 1
+
+    return H_X, H_Z
+
+def get_parity_check_matrices(qubits):
+    """"
+    Returns the parity check matrices for the lattice size of the given qubit configuration, generating them only the
+    first time a given lattice size is requested.
+    
+    :param: qubits: The qubit configuration, as generated by generateSurfaceCodeLattice(d)
+    :return: H_X, H_Z: The parity check matrices, as given by generate_parity_check_matrices
+    """
+
+    d = qubits.shape[0]
+    if d not in parity_check_matrices:
+        parity_check_matrices[d] = generate_parity_check_matrices(qubits)
+
+    return parity_check_matrices[d]
 
 def generate_surface_code_syndrome_NoFT_efficient(error,qubits):
     """"
     This function generates the syndrome (violated stabilizers) corresponding to the input error configuration, 
-    for the surface code.
+    for the surface code. The syndrome is obtained as a single product with the parity check matrices, mod 2.
     
-    :param: error: An error configuration on a square lattice
+    :param: error: An error configuration on a square lattice, or an (n,d,d) stack of error configurations
     :param: qubits: The qubit configuration
-    :return: syndrome: The syndrome corresponding to input error
+    :return: syndrome: The syndrome corresponding to input error, or an (n,d+1,d+1) stack of syndromes
     """
     
-    d = np.shape(error)[0]
-    syndrome = np.zeros((d+1,d+1),int)
+    d = np.shape(error)[-1]
+    H_X, H_Z = get_parity_check_matrices(qubits)
 
-    for i in range(d): 
-        for j in range(d):
-            if error[i,j] != 0:
-                for k in range(qubits.shape[2]):
-                    if qubits[i,j,k,2] != error[i,j] and qubits[i,j,k,2] != 0:
-                        a = qubits[i,j,k,0]
-                        b = qubits[i,j,k,1]
-                        syndrome[a,b] = 1 - syndrome[a,b]
+    flat_error = np.reshape(error, (-1, d**2))
+    X_part = np.logical_or(flat_error == 1, flat_error == 2).astype(int)
+    Z_part = np.logical_or(flat_error == 2, flat_error == 3).astype(int)
+
+    syndrome = np.mod(np.dot(X_part, H_X.T) + np.dot(Z_part, H_Z.T), 2)
                         
-    return syndrome
+    return np.reshape(syndrome, np.shape(error)[:-2] + (d+1, d+1))
 
-def generate_faulty_syndrome(true_syndrome, p_measurement_error):
+stabilizer_masks = {}
+
+def get_stabilizer_mask(d):
+    """"
+    Returns a boolean (d+1)x(d+1) array indicating the syndrome sites which hold a stabilizer of the distance d surface code, 
+    generating it only the first time a given distance is requested.
+    
+    :param: d: The code distance
+    :return: mask: The boolean stabilizer mask
+    """
+
+    if d not in stabilizer_masks:
+        qubits = generateSurfaceCodeLattice(d)
+        mask = np.zeros((d+1,d+1),bool)
+        real_stabilizers = qubits[:,:,:,2] != 0
+        mask[qubits[:,:,:,0][real_stabilizers], qubits[:,:,:,1][real_stabilizers]] = True
+        stabilizer_masks[d] = mask
+
+    return stabilizer_masks[d]
+
+def generate_faulty_syndrome(true_syndrome, p_measurement_error, measurement_errors=None):
     """"
     This function takes in a true syndrome, and generates a faulty syndrome according to some
-    given probability of measurement errors.
+    given probability of measurement errors. A whole stack of syndromes - i.e. a syndrome volume - can be given at once,
+    in which case every slice receives independent measurement errors.
     
-    :param: true_syndrome: The original perfect measurement syndrome
+    :param: true_syndrome: The original perfect measurement syndrome, or an (n,d+1,d+1) stack of syndromes
     :return: p_measurement_error: The probability of measurement error per stabilizer
+    :param: measurement_errors: Optionally a boolean array of the same shape as true_syndrome, giving the measurement errors to apply
     :return: faulty_syndrome: The faulty syndrome
     """
     
-    faulty_syndrome = np.zeros(np.shape(true_syndrome),int)
-
-    # First we take care of the "bulk stabilizers"
-    for row in range(1, true_syndrome.shape[0]-1):
-        for col in range(1,true_syndrome.shape[1]-1):
-            if np.random.rand() < p_measurement_error:
-                faulty_syndrome[row,col] = 1 - true_syndrome[row,col]
-            else:
-                faulty_syndrome[row,col] = true_syndrome[row,col]
-
-    # Now we take care of the boundary stabilizers
-    row = 0
-    for col in [2*x +1 for x in range(int(true_syndrome.shape[0]/2 - 1))]:
-        if np.random.rand() < p_measurement_error:
-                faulty_syndrome[row,col] = 1 - true_syndrome[row,col]
-        else:
-            faulty_syndrome[row,col] = true_syndrome[row,col]
-    row = true_syndrome.shape[0] - 1
-    for col in [2*x + 2 for x in range(int(true_syndrome.shape[0]/2 - 1))]:
-        if np.random.rand() < p_measurement_error:
-                faulty_syndrome[row,col] = 1 - true_syndrome[row,col]
-        else:
-            faulty_syndrome[row,col] = true_syndrome[row,col]
+    mask = get_stabilizer_mask(np.shape(true_syndrome)[-1] - 1)
+    if measurement_errors is None:
+        measurement_errors = np.logical_and(np.random.rand(*np.shape(true_syndrome)) < p_measurement_error, mask)
 
-    col = 0
-    for row in [2*x + 2 for x in range(int(true_syndrome.shape[0]/2 - 1))]:
-        if np.random.rand() < p_measurement_error:
-                faulty_syndrome[row,col] = 1 - true_syndrome[row,col]
-        else:
-            faulty_syndrome[row,col] = true_syndrome[row,col]
-    col = true_syndrome.shape[0] - 1
-    for row in [2*x +1 for x in range(int(true_syndrome.shape[0]/2 - 1))]:
-        if np.random.rand() < p_measurement_error:
-                faulty_syndrome[row,col] = 1 - true_syndrome[row,col]
-        else:
-            faulty_syndrome[row,col] = true_syndrome[row,col]
+    faulty_syndrome = np.where(mask, np.bitwise_xor(np.asarray(true_syndrome).astype(int), measurement_errors), 0)
   
     return faulty_syndrome
 
 
-def obtain_new_error_configuration(old_configuration,new_gates):
+def sample_first_event_volumes(d, p_phys, p_meas, error_model, volume_depth, n):
+    """"
+    This function samples the errors and measurement errors of n syndrome volumes, each conditioned on containing at least one
+    physical or measurement error, together with the number of volumes without any error which preceded it. Starting from a state 
+    with a trivial syndrome, the volumes without any error all have trivial faulty syndromes, and can therefore be skipped at once. 
+
+    The error and measurement error sites of a volume are ordered in time, and the first site at which an error occurs is sampled 
+    from its (truncated geometric) distribution. All sites before it are then error free, and all sites after it are sampled as usual.
+
+    :param: d: The code distance
+    :param: p_phys: The physical error rate
+    :param: p_meas: The measurement error rate
+    :param: error_model: A string in ["X", "DP", "IIDXZ"]
+    :param: volume_depth: The number of error layers and syndrome measurements per volume
+    :param: n: The number of volumes
+    :return: errors: An (n,volume_depth,d,d) array of error layers
+    :return: measurement_errors: A boolean (n,volume_depth,d+1,d+1) array of measurement errors
+    :return: n_skipped: The number of error free volumes preceding each of the volumes
+    """
+
+    mask = get_stabilizer_mask(d)
+    stabilizer_rows, stabilizer_cols = np.nonzero(mask)
+    n_stabilizers = len(stabilizer_rows)
+    n_sites = d**2 + n_stabilizers
+
+    if error_model == "IIDXZ":
+        p_qubit = 1 - (1 - p_phys)**2
+    else:
+        p_qubit = p_phys
+
+    # The survival function of the first error site, in time order: per layer the qubits, then the measurements
+    site_probabilities = np.tile(np.concatenate([np.full(d**2, p_qubit), np.full(n_stabilizers, p_meas)]), volume_depth)
+    log_survival = np.cumsum(np.log1p(-site_probabilities))
+    p_event = -np.expm1(log_survival[-1])
+    if p_event <= 0:
+        raise Exception("a syndrome volume cannot contain any error if both error rates vanish!")
+
+    n_skipped = np.random.geometric(p_event, n) - 1
+    first_sites = np.searchsorted(-log_survival, -np.log1p(-np.random.rand(n)*p_event))
+    first_sites = np.minimum(first_sites, len(log_survival) - 1)
+
+    errors = generate_error_batch(d, p_phys, error_model, n*volume_depth).reshape(n, volume_depth, d, d)
+    measurement_errors = np.logical_and(np.random.rand(n, volume_depth, d + 1, d + 1) < p_meas, mask)
+
+    # Clear all the sites before the first error
+    layers = np.arange(volume_depth)[:, np.newaxis]
+    qubit_sites = layers*n_sites + np.arange(d**2)
+    measurement_sites = layers*n_sites + d**2 + np.arange(n_stabilizers)
+    errors = errors.reshape(n, volume_depth, d**2)
+    errors[qubit_sites[np.newaxis] < first_sites[:, np.newaxis, np.newaxis]] = 0
+    cleared = measurement_sites[np.newaxis] < first_sites[:, np.newaxis, np.newaxis]
+    measurement_errors[:, :, stabilizer_rows, stabilizer_cols] = np.logical_and(measurement_errors[:, :, stabilizer_rows, stabilizer_cols],
+                                                                               np.logical_not(cleared))
+
+    # Place an error at the first site
+    first_layers = first_sites // n_sites
+    first_offsets = first_sites % n_sites
+    on_qubit = first_offsets < d**2
+    if error_model == "X":
+        first_errors = np.ones(n, int)
+    elif error_model == "DP":
+        first_errors = np.random.randint(1, 4, n)
+    else:
+        # Conditioned on at least one of an X and a Z flip: X only, Z only, or both (Y)
+        rand = np.random.rand(n)*p_qubit
+        first_errors = np.where(rand < p_phys*(1 - p_phys), 1, np.where(rand < 2*p_phys*(1 - p_phys), 3, 2))
+    errors[np.flatnonzero(on_qubit), first_layers[on_qubit], first_offsets[on_qubit]] = first_errors[on_qubit]
+    on_measurement = np.logical_not(on_qubit)
+    stabilizers = first_offsets[on_measurement] - d**2
+    measurement_errors[np.flatnonzero(on_measurement), first_layers[on_measurement], 
+                       stabilizer_rows[stabilizers], stabilizer_cols[stabilizers]] = True
+
+    return errors.reshape(n, volume_depth, d, d), measurement_errors, n_skipped
+
+def obtain_new_error_configuration(old_configuration,new_gates,in_place=False):
     """"
     This function generates a new error configuration out of an old configuration and a new configuration,
-     which might arise either from errors or corrections.
+     which might arise either from errors or corrections. The Paulis on every site are multiplied at once, via the
+     XOR of their labels (see pauli_product_table). Stacks of configurations are composed elementwise.
     
-    :param: old_configuration: An error configuration on a square lattice
-    :param: new_gates: An error configuration on a square lattice
+    :param: old_configuration: An error configuration on a square lattice, or an (n,d,d) stack of error configurations
+    :param: new_gates: An error configuration on a square lattice, or an (n,d,d) stack of error configurations
+    :param: in_place: A boolean indicating whether old_configuration (an integer array) should be overwritten with the result
     :return: new_configuration: The resulting error configuration
     """
     
-    new_configuration = np.zeros(np.shape(old_configuration))
-    for row in range(new_configuration.shape[0]):
-        for col in range(new_configuration.shape[1]):
-            new_configuration[row,col] = multiplyPaulis(new_gates[row,col], old_configuration[row,col])
-            
-    return new_configuration
+    if in_place:
+        return np.bitwise_xor(old_configuration, np.asarray(new_gates).astype(old_configuration.dtype), out=old_configuration)
+
+    return np.bitwise_xor(np.asarray(old_configuration).astype(int), np.asarray(new_gates).astype(int))
 
 def index_to_move(d,move_index,error_model,use_Y=True):
     """"
@@ -252,7 +360,7 @@ def index_to_move(d,move_index,error_model,use_Y=True):
     :return: new_move: A lattice representation of the desired move.
     """
 
-    new_move = np.zeros((d,d))
+    new_move = np.zeros((d,d),int)
     
     if error_model == "X":
         if move_index < (d**2):
@@ -299,28 +407,1218 @@ def generate_one_hot_labels_surface_code(error,err_model):
     This function generates the homology class label, in a one-hot encoding, for a given perfect syndrome, to use as the target label
     for a feed forward neural network homology class predicting decoder.
 
-    :param: error: An error configuration on a square lattice
+    :param: error: An error configuration on a square lattice, or an (n,d,d) stack of error configurations
     :param: err_model: A string in ["IIDXZ","DP","X"]
-    :return: training_label: The one-encoded training label
+    :return: training_label: The one-encoded training label, or an (n,num_classes) stack of labels
     """
     
-    d = error.shape[0]
-    
-    X = 0
-    Z = 0
-        
-    for x in range(d):
-        if error[x,0] == 1 or error[x,0] == 2:
-            X = 1 - X
-    for y in range(d):
-        if error[0,y] == 3 or error[0,y] == 2:
-            Z = 1 - Z
+    error = np.asarray(error)
+
+    first_column = error[...,:,0]
+    first_row = error[...,0,:]
+    X = np.sum(np.logical_or(first_column == 1, first_column == 2), axis=-1) % 2
+    Z = np.sum(np.logical_or(first_row == 3, first_row == 2), axis=-1) % 2
             
+    if err_model in ["IIDXZ","DP"]:
+        num_classes = 4
+    else:
+        num_classes = 2
+
+    training_label = np.eye(num_classes, dtype=int)[X + 2*Z]
+    
+    return training_label
+
+def pack_error_configuration(error):
+    """"
+    This function generates the symplectic bit-packed representation of an error configuration. Qubit (i,j) corresponds
+    to bit i*d+j of each of the returned integers.
+    
+    :param: error: An error configuration on a square lattice
+    :return: x_bits: An integer whose set bits indicate the qubits with an X or Y error
+    :return: z_bits: An integer whose set bits indicate the qubits with a Z or Y error
+    """
+
+    flat_error = np.reshape(error, -1)
+    x_bits = 0
+    z_bits = 0
+    for index in np.flatnonzero(flat_error):
+        if flat_error[index] == 1 or flat_error[index] == 2:
+            x_bits |= 1 << int(index)
+        if flat_error[index] == 3 or flat_error[index] == 2:
+            z_bits |= 1 << int(index)
+
+    return x_bits, z_bits
+
+def unpack_error_configuration(x_bits, z_bits, d):
+    """"
+    This function reverses pack_error_configuration.
+    
+    :param: x_bits: An integer whose set bits indicate the qubits with an X or Y error
+    :param: z_bits: An integer whose set bits indicate the qubits with a Z or Y error
+    :param: d: The code distance
+    :return: error: The error configuration on a square dxd lattice
+    """
+
+    error = np.zeros(d**2, int)
+    for index in range(d**2):
+        X = (x_bits >> index) & 1
+        Z = (z_bits >> index) & 1
+        error[index] = [0,1,3,2][X + 2*Z]
+
+    return np.reshape(error, (d,d))
+
+def bit_parity(bits):
+    """"
+    A simple helper function which returns the parity of the number of set bits in an integer.
+    """
+
+    return bin(bits).count("1") % 2
+
+def generate_packed_syndrome_masks(qubits):
+    """"
+    This function generates, for every stabilizer, the bit masks of the qubits on which an X or a Z flip violates that stabilizer.
+    
+    :param: qubits: The qubit configuration, as generated by generateSurfaceCodeLattice(d)
+    :return: syndrome_masks: A list of (stabilizer_index, X_mask, Z_mask), with stabilizer_index = a*(d+1)+b, for all non-trivial stabilizers
+    """
+
+    H_X, H_Z = get_parity_check_matrices(qubits)
+    syndrome_masks = []
+    for stabilizer_index in range(H_X.shape[0]):
+        X_mask = sum(1 << int(index) for index in np.flatnonzero(H_X[stabilizer_index]))
+        Z_mask = sum(1 << int(index) for index in np.flatnonzero(H_Z[stabilizer_index]))
+        if X_mask != 0 or Z_mask != 0:
+            syndrome_masks.append((stabilizer_index, X_mask, Z_mask))
+
+    return syndrome_masks
+
+def generate_packed_syndrome(x_bits, z_bits, syndrome_masks, d):
+    """"
+    This function generates the syndrome corresponding to a bit-packed error configuration, as the parity of the
+    error bits supported on each stabilizer.
+    
+    :param: x_bits: An integer whose set bits indicate the qubits with an X or Y error
+    :param: z_bits: An integer whose set bits indicate the qubits with a Z or Y error
+    :param: syndrome_masks: The stabilizer masks, as generated by generate_packed_syndrome_masks
+    :param: d: The code distance
+    :return: syndrome: The syndrome corresponding to the input error
+    """
+
+    syndrome = np.zeros((d+1)**2, int)
+    for stabilizer_index, X_mask, Z_mask in syndrome_masks:
+        syndrome[stabilizer_index] = bit_parity((x_bits & X_mask) ^ (z_bits & Z_mask))
+
+    return np.reshape(syndrome, (d+1,d+1))
+
+def generate_packed_logical_masks(d):
+    """"
+    This function generates the bit masks of the qubits whose X (respectively Z) errors determine the homology class,
+    as used in generate_one_hot_labels_surface_code.
+    
+    :param: d: The code distance
+    :return: X_mask: The mask of the qubits in the first column
+    :return: Z_mask: The mask of the qubits in the first row
+    """
+
+    X_mask = sum(1 << (x*d) for x in range(d))
+    Z_mask = sum(1 << y for y in range(d))
+
+    return X_mask, Z_mask
+
+def generate_one_hot_labels_packed(x_bits, z_bits, logical_masks, err_model):
+    """"
+    This function generates the homology class label, in a one-hot encoding, for a bit-packed error configuration. 
+    
+    :param: x_bits: An integer whose set bits indicate the qubits with an X or Y error
+    :param: z_bits: An integer whose set bits indicate the qubits with a Z or Y error
+    :param: logical_masks: The masks, as generated by generate_packed_logical_masks
+    :param: err_model: A string in ["IIDXZ","DP","X"]
+    :return: training_label: The one-encoded training label
+    """
+
+    X = bit_parity(x_bits & logical_masks[0])
+    Z = bit_parity(z_bits & logical_masks[1])
+
     if err_model in ["IIDXZ","DP"]:
         training_label = np.zeros(4,int)                       
     else:
         training_label = np.zeros(2,int)
 
     training_label[X + 2*Z] = 1
-    
+
     return training_label
+
+class CachedStaticDecoder():
+    """"
+    A wrapper around a homology class predicting referee/static decoder which memoizes its predictions, keyed by the bit-packed
+    perfect syndrome. It provides the same predict method as the wrapped Keras model, and can therefore be given to an environment
+    in place of the static decoder itself. Each call to predict may contain syndromes from many environments, and at most one
+    call to the wrapped decoder is made, for the syndromes which are not yet in the cache.
+
+    :param: static_decoder: A homology class predicting decoder for perfect syndromes.
+    :param: max_size: The maximum number of syndromes kept in the cache, the least recently used being discarded first.
+    """
+
+    def __init__(self, static_decoder, max_size=100000):
+
+        self.static_decoder = static_decoder
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def predict(self, syndromes, batch_size=None, verbose=0):
+        """"
+        Predict the homology class of each syndrome.
+
+        :param: syndromes: An (n,(d+1)**2) array of perfect syndrome vectors
+        :param: batch_size: The batch size for the wrapped decoder. Defaults to all the uncached syndromes at once.
+        :param: verbose: The verbosity of the wrapped decoder
+        :return: predictions: The (n,num_classes) array of predictions
+        """
+
+        syndromes = np.asarray(syndromes)
+        packed_syndromes = np.packbits(syndromes != 0, axis=1)
+        keys = [packed_syndrome.tobytes() for packed_syndrome in packed_syndromes]
+
+        predictions = [None]*len(keys)
+        uncached = OrderedDict()
+        for j, key in enumerate(keys):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                predictions[j] = self.cache[key]
+                self.hits += 1
+            elif key in uncached:
+                uncached[key].append(j)
+                self.hits += 1
+            else:
+                uncached[key] = [j]
+                self.misses += 1
+
+        if len(uncached) > 0:
+            queries = syndromes[[indices[0] for indices in uncached.values()]]
+            if batch_size is None:
+                batch_size = len(queries)
+            new_predictions = self.static_decoder.predict(queries, batch_size=batch_size, verbose=verbose)
+            for (key, indices), prediction in zip(uncached.items(), new_predictions):
+                for j in indices:
+                    predictions[j] = prediction
+                self.cache[key] = prediction
+                if len(self.cache) > self.max_size:
+                    self.cache.popitem(last=False)
+
+        return np.array(predictions)
+
+    def cache_info(self):
+        """"
+        Returns a dictionary with the number of cache hits and misses, and the current and maximum number of cached syndromes.
+        """
+
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "max_size": self.max_size}
+
+    def clear_cache(self):
+        """"
+        Empties the cache and resets the hit and miss counters.
+        """
+
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+def syndromes_to_keys(syndromes, d):
+    """"
+    This function converts perfect syndrome vectors into integer keys, in which bit k indicates whether the k'th real stabilizer
+    (in the row-wise order of get_stabilizer_mask(d)) is violated.
+    
+    :param: syndromes: An (n,(d+1)**2) array of perfect syndrome vectors
+    :param: d: The code distance
+    :return: keys: An array of n int64 keys
+    """
+
+    stabilizer_indices = np.flatnonzero(get_stabilizer_mask(d))
+    bits = (np.asarray(syndromes)[:, stabilizer_indices] != 0).astype(np.int64)
+
+    return np.dot(bits, np.left_shift(np.int64(1), np.arange(len(stabilizer_indices), dtype=np.int64)))
+
+def keys_to_syndromes(keys, d):
+    """"
+    This function reverses syndromes_to_keys.
+    
+    :param: keys: An array of n integer keys
+    :param: d: The code distance
+    :return: syndromes: An (n,(d+1)**2) array of perfect syndrome vectors
+    """
+
+    stabilizer_indices = np.flatnonzero(get_stabilizer_mask(d))
+    keys = np.asarray(keys, np.int64)
+
+    syndromes = np.zeros((len(keys), (d+1)**2), int)
+    syndromes[:, stabilizer_indices] = np.bitwise_and(np.right_shift(keys[:, np.newaxis], np.arange(len(stabilizer_indices), dtype=np.int64)), 1)
+
+    return syndromes
+
+def generate_referee_table(static_decoder, d, max_weight=None, chunk_size=65536):
+    """"
+    This function evaluates a referee/static decoder on every perfect syndrome of the distance d surface code, or on every syndrome with
+    at most max_weight violated stabilizers, and records the predicted homology classes.
+    
+    :param: static_decoder: A homology class predicting decoder for perfect syndromes.
+    :param: d: The code distance
+    :param: max_weight: The maximum syndrome weight to include. If None, all syndromes are included and the keys are simply 0,1,2,...
+    :param: chunk_size: The number of syndromes given to the decoder at a time
+    :return: keys: The sorted int64 keys of the included syndromes, as given by syndromes_to_keys
+    :return: classes: The uint8 homology class predicted for each key
+    :return: num_classes: The number of homology classes of the decoder
+    """
+
+    num_stabilizers = int(np.sum(get_stabilizer_mask(d)))
+
+    if max_weight is None:
+        keys = np.arange(2**num_stabilizers, dtype=np.int64)
+    else:
+        keys = [0]
+        for weight in range(1, max_weight+1):
+            for violated in itertools.combinations(range(num_stabilizers), weight):
+                keys.append(sum(1 << k for k in violated))
+        keys = np.sort(np.array(keys, np.int64))
+
+    classes = np.zeros(len(keys), np.uint8)
+    num_classes = 0
+    for start in range(0, len(keys), chunk_size):
+        syndromes = keys_to_syndromes(keys[start:start+chunk_size], d)
+        predictions = static_decoder.predict(syndromes, batch_size=len(syndromes), verbose=0)
+        classes[start:start+chunk_size] = np.argmax(predictions, axis=1)
+        num_classes = np.shape(predictions)[1]
+
+    return keys, classes, num_classes
+
+def save_referee_table(directory, d, keys, classes, num_classes):
+    """"
+    This function writes a table generated by generate_referee_table into a directory, in a form which RefereeLookupTable can memory-map.
+    
+    :param: directory: The directory in which to save the table
+    :param: d: The code distance
+    :param: keys: The sorted keys of the included syndromes
+    :param: classes: The homology class predicted for each key
+    :param: num_classes: The number of homology classes of the decoder
+    """
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    dense = len(keys) == 2**int(np.sum(get_stabilizer_mask(d)))
+    np.save(os.path.join(directory, "classes.npy"), classes)
+    if not dense:
+        np.save(os.path.join(directory, "keys.npy"), keys)
+
+    table_info = {"d": d, "num_classes": num_classes, "dense": dense}
+    pickle.dump(table_info, open(os.path.join(directory, "table_info.p"), "wb" ) )
+
+class RefereeLookupTable():
+    """"
+    A referee/static decoder which looks up precomputed predictions, as saved by save_referee_table, instead of evaluating a neural network.
+    The table is memory-mapped, so that it is shared between processes and only the pages which are needed are read. It provides the
+    same predict method as a Keras model, and can therefore be given to an environment as the static decoder.
+
+    :param: directory: The directory containing the table
+    :param: fallback_decoder: An optional decoder for the syndromes which are not in a table of bounded syndrome weight
+    """
+
+    def __init__(self, directory, fallback_decoder=None):
+
+        table_info = pickle.load( open(os.path.join(directory, "table_info.p"), "rb" ) )
+        self.d = table_info["d"]
+        self.num_classes = table_info["num_classes"]
+        self.dense = table_info["dense"]
+        self.fallback_decoder = fallback_decoder
+
+        self.classes = np.load(os.path.join(directory, "classes.npy"), mmap_mode="r")
+        if self.dense:
+            self.keys = None
+        else:
+            self.keys = np.load(os.path.join(directory, "keys.npy"), mmap_mode="r")
+
+    def predict(self, syndromes, batch_size=None, verbose=0):
+        """"
+        Predict the homology class of each syndrome, as a one-hot vector.
+
+        :param: syndromes: An (n,(d+1)**2) array of perfect syndrome vectors
+        :param: batch_size: Unused, present for compatibility with Keras models.
+        :param: verbose: Unused, present for compatibility with Keras models.
+        :return: predictions: The (n,num_classes) array of predictions
+        """
+
+        syndromes = np.asarray(syndromes)
+        keys = syndromes_to_keys(syndromes, self.d)
+
+        if self.dense:
+            classes = np.asarray(self.classes[keys])
+            predictions = np.eye(self.num_classes)[classes]
+        else:
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[positions] == keys
+            predictions = np.zeros((len(keys), self.num_classes))
+            predictions[found] = np.eye(self.num_classes)[np.asarray(self.classes[positions[found]])]
+
+            if not np.all(found):
+                if self.fallback_decoder is None:
+                    raise Exception("syndrome is not in the referee lookup table, and no fallback decoder was given!")
+                missing = np.flatnonzero(np.logical_not(found))
+                predictions[missing] = self.fallback_decoder.predict(syndromes[missing], batch_size=len(missing), verbose=0)
+
+        return predictions
+
+class NumpyDQN():
+    """"
+    A pure NumPy implementation of the forward pass of the (possibly dueling) deep Q network built by build_convolutional_nn, for
+    fast inference without Keras/TensorFlow. Convolutions are evaluated as a gather of the input patches, with precomputed
+    indices, followed by a single matrix product. All intermediate arrays are allocated once per batch size and then reused.
+    Dropout is inactive at inference time and is therefore ignored.
+
+    Activations are kept in (height, width, channels) order between layers, and the rows of the first dense kernel are permuted
+    accordingly, so that no transposes are required.
+
+    :param: conv_weights: A list of [kernel, bias] for each convolutional layer, with kernels in the Keras (kh, kw, in, out) layout
+    :param: conv_strides: A list of the strides of each convolutional layer
+    :param: dense_weights: A list of [kernel, bias] for each dense layer, including the output (and dueling) layers
+    :param: input_shape: The shape of a single (channels first) input state
+    :param: n_hidden_dense: The number of dense layers followed by a relu activation
+    :param: dueling: A boolean indicating whether the final dense layer is the dueling head added by the DQN agent
+    :param: dueling_type: A string in ["avg", "max", "naive"] giving the dueling aggregation, as in the DQN agent
+    """
+
+    def __init__(self, conv_weights, conv_strides, dense_weights, input_shape, n_hidden_dense, dueling=True, dueling_type="avg"):
+
+        self.input_shape = tuple(input_shape)
+        self.n_hidden_dense = n_hidden_dense
+        self.dueling = dueling
+        self.dueling_type = dueling_type
+        self.buffers = {}
+
+        # Precompute, for each convolutional layer, the indices of the flattened input which make up each patch
+        self.conv_layers = []
+        self.conv_output_shapes = []
+        channels, height, width = self.input_shape
+        channels_first = True
+        for (kernel, bias), stride in zip(conv_weights, conv_strides):
+            kh, kw, _, n_filters = np.shape(kernel)
+            out_height = int((height - kh)/stride) + 1
+            out_width = int((width - kw)/stride) + 1
+
+            rows = (np.arange(out_height)*stride)[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis] + np.arange(kh)[:, np.newaxis, np.newaxis]
+            cols = (np.arange(out_width)*stride)[np.newaxis, :, np.newaxis, np.newaxis, np.newaxis] + np.arange(kw)[:, np.newaxis]
+            chans = np.arange(channels)
+            if channels_first:
+                gather = chans*height*width + rows*width + cols
+            else:
+                gather = (rows*width + cols)*channels + chans
+            gather = np.reshape(gather, (out_height*out_width, kh*kw*channels))
+
+            self.conv_layers.append((gather, np.reshape(np.asarray(kernel, np.float32), (kh*kw*channels, n_filters)), np.asarray(bias, np.float32)))
+            self.conv_output_shapes.append((out_height*out_width, n_filters))
+            channels, height, width = n_filters, out_height, out_width
+            channels_first = False
+
+        # Keras flattens the channels first output of the last convolution in (channels, height, width) order
+        self.dense_layers = []
+        for j, (kernel, bias) in enumerate(dense_weights):
+            kernel = np.asarray(kernel, np.float32)
+            if j == 0 and len(self.conv_layers) > 0:
+                chw_rows = np.arange(channels*height*width).reshape(channels, height, width)
+                kernel = kernel[np.transpose(chw_rows, (1, 2, 0)).reshape(-1)]
+            self.dense_layers.append((np.ascontiguousarray(kernel), np.asarray(bias, np.float32)))
+
+        self.num_actions = self.dense_layers[-1][0].shape[1] - (1 if self.dueling else 0)
+
+    def get_buffers(self, batch_size):
+        """"
+        Returns the intermediate arrays for a given batch size, allocating them the first time that batch size is used.
+        """
+
+        if batch_size not in self.buffers:
+            conv_buffers = [(np.empty((batch_size,) + gather.shape, np.float32), np.empty((batch_size,) + output_shape, np.float32)) 
+                            for (gather, _, _), output_shape in zip(self.conv_layers, self.conv_output_shapes)]
+            dense_buffers = [np.empty((batch_size, kernel.shape[1]), np.float32) for kernel, _ in self.dense_layers]
+            self.buffers[batch_size] = (np.empty((batch_size,) + self.input_shape, np.float32), conv_buffers, dense_buffers)
+
+        return self.buffers[batch_size]
+
+    def q_values(self, states):
+        """"
+        Evaluate the Q-values of a single state, or of a batch of states.
+
+        :param: states: A single state of shape input_shape, or an (n,)+input_shape batch of states
+        :return: q_values: The num_actions Q-values, or an (n,num_actions) array of Q-values
+        """
+
+        states = np.asarray(states)
+        single_state = states.ndim == len(self.input_shape)
+        if single_state:
+            states = states[np.newaxis]
+
+        batch_size = states.shape[0]
+        input_buffer, conv_buffers, dense_buffers = self.get_buffers(batch_size)
+        input_buffer[...] = states
+
+        activation = np.reshape(input_buffer, (batch_size, -1))
+        for (gather, kernel, bias), (patches, output) in zip(self.conv_layers, conv_buffers):
+            np.take(activation, gather, axis=1, out=patches, mode="clip")
+            np.matmul(patches, kernel, out=output)
+            output += bias
+            np.maximum(output, 0, out=output)
+            activation = np.reshape(output, (batch_size, -1))
+
+        for j, ((kernel, bias), output) in enumerate(zip(self.dense_layers, dense_buffers)):
+            np.dot(activation, kernel, out=output)
+            output += bias
+            if j < self.n_hidden_dense:
+                np.maximum(output, 0, out=output)
+            activation = output
+
+        if self.dueling:
+            advantages = activation[:, 1:]
+            if self.dueling_type == "avg":
+                q_values = activation[:, :1] + advantages - np.mean(advantages, axis=1, keepdims=True)
+            elif self.dueling_type == "max":
+                q_values = activation[:, :1] + advantages - np.max(advantages, axis=1, keepdims=True)
+            else:
+                q_values = activation[:, :1] + advantages
+        else:
+            q_values = np.copy(activation)
+
+        if single_state:
+            return q_values[0]
+        return q_values
+
+    def forward(self, states):
+        """"
+        Select the greedy action for a single state, or for each state of a batch.
+
+        :param: states: A single state of shape input_shape, or an (n,)+input_shape batch of states
+        :return: actions: The greedy action, or an array of n greedy actions
+        """
+
+        q_values = self.q_values(states)
+        if q_values.ndim == 1:
+            return int(np.argmax(q_values))
+        return np.argmax(q_values, axis=1)
+
+def build_numpy_dqn(weights, fixed_configs, dueling_type="avg"):
+    """"
+    This function builds a NumpyDQN from the weights of a DQN agent, as given by get_weights() of the agent's (Keras) model, i.e. 
+    an alternating list of kernels and biases. The network architecture is taken from the fixed configuration used to train the agent.
+    
+    :param: weights: The list of kernels and biases of the agent's model
+    :param: fixed_configs: The fixed configuration dictionary (i.e. the contents of fixed_config.p)
+    :param: dueling_type: The dueling aggregation used by the agent
+    :return: numpy_dqn: The NumpyDQN
+    """
+
+    n_action_layers = 1
+    if fixed_configs["error_model"] == "DP":
+        n_action_layers = 3 if fixed_configs["use_Y"] else 2
+    input_shape = (fixed_configs["volume_depth"] + n_action_layers, 2*fixed_configs["d"] + 1, 2*fixed_configs["d"] + 1)
+
+    conv_weights = []
+    dense_weights = []
+    for kernel, bias in zip(weights[::2], weights[1::2]):
+        if np.ndim(kernel) == 4:
+            conv_weights.append([kernel, bias])
+        else:
+            dense_weights.append([kernel, bias])
+
+    # The ff_layers, the output layer and, if dueling, the dueling head
+    expected_dense = len(fixed_configs["ff_layers"]) + 1 + (1 if fixed_configs["dueling"] else 0)
+    if len(conv_weights) != len(fixed_configs["c_layers"]) or len(dense_weights) != expected_dense:
+        raise Exception("the saved weights do not match the architecture given by the fixed configuration!")
+
+    return NumpyDQN(conv_weights, [c_layer[2] for c_layer in fixed_configs["c_layers"]], dense_weights, input_shape, 
+                    n_hidden_dense=len(fixed_configs["ff_layers"]), dueling=fixed_configs["dueling"], dueling_type=dueling_type)
+
+def load_numpy_dqn(weights_path, fixed_configs_path, dueling_type="avg"):
+    """"
+    This function loads the weights saved by a DQN agent (i.e. final_dqn_weights.h5f) into a NumpyDQN. The network architecture
+    is taken from the fixed configuration file (i.e. fixed_config.p) used to train the agent. Requires h5py.
+    
+    :param: weights_path: The path to the saved weights
+    :param: fixed_configs_path: The path to the fixed configuration file
+    :param: dueling_type: The dueling aggregation used by the agent
+    :return: numpy_dqn: The NumpyDQN
+    """
+
+    import h5py
+
+    fixed_configs = pickle.load( open(fixed_configs_path, "rb" ) )
+
+    weights = []
+    with h5py.File(weights_path, "r") as weights_file:
+        for layer_name in weights_file.attrs["layer_names"]:
+            layer = weights_file[layer_name]
+            for weight_name in layer.attrs["weight_names"]:
+                weights.append(layer[weight_name][()])
+
+    return build_numpy_dqn(weights, fixed_configs, dueling_type)
+
+Experience = namedtuple("Experience", "state0, action, reward, state1, terminal1")
+
+class CompactSequentialMemory():
+    """"
+    A replay memory which can be given to a DQN agent in place of keras-rl's SequentialMemory, and which samples experiences in the 
+    same way. Observations of the surface code environments only contain zeros and ones, and are therefore stored bit-packed. All 
+    entries are stored in preallocated ring arrays, which can be saved into a directory and memory-mapped again with load_compact_memory.
+
+    If volume_depth is given, consecutive observations which share their syndrome volume - i.e. all observations between two identities -
+    store that volume only once. Each entry then only consists of the id of its syndrome volume, the bit mask of the actions already 
+    performed (the qubit cells of the action history slices), the action, the reward and the terminal flag, and the full observations
+    are rebuilt when sampling. The ring array of syndrome volumes grows only as far as needed to hold the volumes of all the entries.
+
+    :param: limit: The maximum number of entries in the memory
+    :param: window_length: The number of consecutive observations forming a state
+    :param: ignore_episode_boundaries: Whether states may contain observations from different episodes
+    :param: volume_depth: The number of syndrome slices at the start of each observation, to store each syndrome volume only once
+    """
+
+    def __init__(self, limit, window_length=1, ignore_episode_boundaries=False, volume_depth=None):
+
+        self.limit = limit
+        self.window_length = window_length
+        self.ignore_episode_boundaries = ignore_episode_boundaries
+        self.volume_depth = volume_depth
+
+        self.recent_observations = deque(maxlen=window_length)
+        self.recent_terminals = deque(maxlen=window_length)
+
+        self.observation_shape = None
+        self.observations = None
+        self.volumes = None
+        self.volume_ids = None
+        self.action_histories = None
+        self.next_volume_index = 0
+        self.actions = np.zeros(limit, np.int16)
+        self.rewards = np.zeros(limit, np.float32)
+        self.terminals = np.zeros(limit, bool)
+        self.next_index = 0
+        self.nb_entries = 0
+
+    def allocate_observations(self, observation_shape):
+        """"
+        Allocates the ring arrays for the bit-packed observations, or for the syndrome volumes and action histories.
+
+        :param: observation_shape: The shape of a single observation
+        """
+
+        self.observation_shape = tuple(observation_shape)
+        if self.volume_depth is None:
+            self.observations = np.zeros((self.limit, (int(np.prod(self.observation_shape)) + 7)//8), np.uint8)
+        else:
+            self.volumes = np.zeros((min(self.limit, 1024), (self.volume_size() + 7)//8), np.uint8)
+            self.volume_ids = np.zeros(self.limit, np.int32)
+            self.action_histories = np.zeros((self.limit, (self.action_history_size() + 7)//8), np.uint8)
+
+    def volume_size(self):
+        """"
+        Returns the number of cells in the syndrome slices of an observation.
+        """
+
+        return self.volume_depth*self.observation_shape[1]*self.observation_shape[2]
+
+    def action_history_size(self):
+        """"
+        Returns the number of qubit cells in the action history slices of an observation.
+        """
+
+        return (self.observation_shape[0] - self.volume_depth)*(self.observation_shape[1]//2)*(self.observation_shape[2]//2)
+
+    def store_observation(self, index, observation):
+        """"
+        Stores an observation into the ring arrays.
+
+        :param: index: The position in the ring arrays
+        :param: observation: The observation
+        """
+
+        if self.volume_depth is None:
+            self.observations[index] = np.packbits(observation.reshape(-1) != 0)
+            return
+
+        # A new syndrome volume is only stored if it differs from the one of the previous entry
+        packed_volume = np.packbits(observation[:self.volume_depth].reshape(-1) != 0)
+        last_volume_index = (self.next_volume_index - 1) % len(self.volumes)
+        if self.nb_entries == 0 or not np.array_equal(packed_volume, self.volumes[last_volume_index]):
+            if self.nb_entries > 0 and len(self.volumes) < self.limit:
+                oldest_volume_index = self.volume_ids[(self.next_index - self.nb_entries) % self.limit]
+                if (last_volume_index - oldest_volume_index) % len(self.volumes) + 1 == len(self.volumes):
+                    self.grow_volumes(oldest_volume_index)
+            self.volumes[self.next_volume_index] = packed_volume
+            last_volume_index = self.next_volume_index
+            self.next_volume_index = (self.next_volume_index + 1) % len(self.volumes)
+        self.volume_ids[index] = last_volume_index
+
+        action_slices = observation[self.volume_depth:]
+        action_history = action_slices[:, 1::2, 1::2]
+        if np.count_nonzero(action_slices) != np.count_nonzero(action_history):
+            raise Exception("only the qubit cells of the action history can be stored by a memory which deduplicates syndrome volumes!")
+        self.action_histories[index] = np.packbits(action_history.reshape(-1) != 0)
+
+    def grow_volumes(self, oldest_volume_index):
+        """"
+        Doubles the size of the ring array of syndrome volumes, once all of its volumes are in use. The volumes in use are moved to the
+        start of the new array, and the volume ids of the entries are updated accordingly.
+
+        :param: oldest_volume_index: The index of the volume of the oldest entry in the memory
+        """
+
+        nb_volumes = len(self.volumes)
+        volumes = np.zeros((min(2*nb_volumes, self.limit), self.volumes.shape[1]), np.uint8)
+        volumes[:nb_volumes] = self.volumes[(oldest_volume_index + np.arange(nb_volumes)) % nb_volumes]
+
+        self.volumes = volumes
+        self.volume_ids = (np.asarray(self.volume_ids) - oldest_volume_index) % nb_volumes
+        self.next_volume_index = nb_volumes
+
+    def get_observation(self, idx):
+        """"
+        Returns an unpacked observation.
+
+        :param: idx: The index of the entry, counted from the oldest entry in the memory
+        :return: observation: The observation
+        """
+
+        physical_index = (self.next_index - self.nb_entries + idx) % self.limit
+        if self.volume_depth is None:
+            packed_observation = self.observations[physical_index]
+            return np.unpackbits(packed_observation)[:int(np.prod(self.observation_shape))].reshape(self.observation_shape)
+
+        observation = np.zeros(self.observation_shape, np.uint8)
+        volume = np.unpackbits(self.volumes[self.volume_ids[physical_index]])[:self.volume_size()]
+        observation[:self.volume_depth] = volume.reshape((self.volume_depth,) + self.observation_shape[1:])
+        action_history = np.unpackbits(self.action_histories[physical_index])[:self.action_history_size()]
+        observation[self.volume_depth:, 1::2, 1::2] = action_history.reshape(-1, self.observation_shape[1]//2, self.observation_shape[2]//2)
+        return observation
+
+    def get_state(self, idx):
+        """"
+        Returns the window of observations ending in the given entry, padded with zeros at the start of an episode.
+
+        :param: idx: The index of the last entry of the state, counted from the oldest entry in the memory
+        :return: state: A list of window_length observations
+        """
+
+        state = [self.get_observation(idx)]
+        for offset in range(0, self.window_length - 1):
+            current_idx = idx - 1 - offset
+            if current_idx < 0 or (self.get_terminal(current_idx - 1) and not self.ignore_episode_boundaries):
+                break
+            state.insert(0, self.get_observation(current_idx))
+        while len(state) < self.window_length:
+            state.insert(0, np.zeros(self.observation_shape, np.uint8))
+        return state
+
+    def get_terminal(self, idx):
+        """"
+        Returns whether the step taken from the given entry ended the episode.
+
+        :param: idx: The index of the entry, counted from the oldest entry in the memory
+        """
+
+        return idx >= 0 and self.terminals[(self.next_index - self.nb_entries + idx) % self.limit]
+
+    def sample(self, batch_size, batch_idxs=None):
+        """"
+        Samples a batch of experiences, uniformly from all the transitions which do not cross an episode boundary.
+
+        :param: batch_size: The number of experiences
+        :param: batch_idxs: Optionally the indices of the entries from which to build the experiences
+        :return: experiences: A list of Experience tuples
+        """
+
+        if self.nb_entries < self.window_length + 2:
+            raise Exception("not enough entries in the memory to sample from!")
+
+        if batch_idxs is None:
+            batch_idxs = self.sample_batch_indexes(self.window_length, self.nb_entries - 1, batch_size)
+        batch_idxs = np.array(batch_idxs) + 1
+
+        experiences = []
+        for idx in batch_idxs:
+            # The first observation of an episode follows the last observation of the previous one, and is not a valid next state
+            while self.get_terminal(idx - 2):
+                idx = self.sample_batch_indexes(self.window_length + 1, self.nb_entries, 1)[0]
+
+            state0 = self.get_state(idx - 1)
+            state1 = state0[1:] + [self.get_observation(idx)]
+            physical_index = (self.next_index - self.nb_entries + idx - 1) % self.limit
+            experiences.append(Experience(state0=state0, action=int(self.actions[physical_index]), reward=float(self.rewards[physical_index]),
+                                          state1=state1, terminal1=bool(self.terminals[physical_index])))
+        return experiences
+
+    def sample_batch_indexes(self, low, high, size):
+        """"
+        Samples indices in [low, high), without replacement whenever there are enough of them.
+        """
+
+        if high - low >= size:
+            return random.sample(range(low, high), size)
+        return [random.randrange(low, high) for j in range(size)]
+
+    def append(self, observation, action, reward, terminal, training=True):
+        """"
+        Adds an entry to the memory, overwriting the oldest entry once the memory is full.
+
+        :param: observation: The observation from which the action was taken
+        :param: action: The action
+        :param: reward: The reward obtained for the action
+        :param: terminal: Whether the action ended the episode
+        :param: training: Whether the agent is training - only then is the entry stored
+        """
+
+        self.recent_observations.append(observation)
+        self.recent_terminals.append(terminal)
+
+        if training:
+            observation = np.asarray(observation)
+            if self.observation_shape is None:
+                self.allocate_observations(observation.shape)
+
+            self.store_observation(self.next_index, observation)
+            self.actions[self.next_index] = action
+            self.rewards[self.next_index] = reward
+            self.terminals[self.next_index] = terminal
+            self.next_index = (self.next_index + 1) % self.limit
+            self.nb_entries = min(self.nb_entries + 1, self.limit)
+
+    def get_recent_state(self, current_observation):
+        """"
+        Returns the state formed by the given observation and the most recent observations of the current episode.
+
+        :param: current_observation: The current observation
+        :return: state: A list of window_length observations
+        """
+
+        state = [current_observation]
+        idx = len(self.recent_observations) - 1
+        for offset in range(0, self.window_length - 1):
+            current_idx = idx - offset
+            current_terminal = self.recent_terminals[current_idx - 1] if current_idx - 1 >= 0 else False
+            if current_idx < 0 or (not self.ignore_episode_boundaries and current_terminal):
+                break
+            state.insert(0, self.recent_observations[current_idx])
+        while len(state) < self.window_length:
+            state.insert(0, np.zeros(np.shape(state[0])))
+        return state
+
+    def get_config(self):
+
+        return {"limit": self.limit, "window_length": self.window_length, "ignore_episode_boundaries": self.ignore_episode_boundaries}
+
+    def save(self, directory):
+        """"
+        Saves the memory into a directory, from which it can be memory-mapped with load_compact_memory. Every file is first written
+        under a temporary name and then moved into place, so that a memory which was itself memory-mapped from this directory can safely 
+        be saved back into it.
+
+        :param: directory: The directory in which to save the memory
+        """
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        arrays = {"actions": self.actions, "rewards": self.rewards, "terminals": self.terminals}
+        if self.observation_shape is not None and self.volume_depth is None:
+            arrays["observations"] = self.observations
+        elif self.observation_shape is not None:
+            arrays["volumes"] = self.volumes
+            arrays["volume_ids"] = self.volume_ids
+            arrays["action_histories"] = self.action_histories
+        self.save_arrays(directory, arrays)
+
+        memory_info = {"limit": self.limit, "window_length": self.window_length, "ignore_episode_boundaries": self.ignore_episode_boundaries,
+                       "observation_shape": self.observation_shape, "next_index": self.next_index, "nb_entries": self.nb_entries,
+                       "volume_depth": self.volume_depth, "next_volume_index": self.next_volume_index}
+        pickle.dump(memory_info, open(os.path.join(directory, "memory_info.p"), "wb" ) )
+
+    def save_arrays(self, directory, arrays):
+        """"
+        Saves arrays into .npy files, each of which is first written under a temporary name and then moved into place.
+
+        :param: directory: The directory in which to save the arrays
+        :param: arrays: A dictionary of the arrays, by file name
+        """
+
+        for name, array in arrays.items():
+            path = os.path.join(directory, name + ".npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(path + ".tmp", path)
+
+def load_compact_memory(directory, mmap_mode="c"):
+    """"
+    This function loads a replay memory saved by CompactSequentialMemory.save (or PrioritizedCompactMemory.save). By default the arrays
+    are memory-mapped copy-on-write, so that loading is immediate, only the pages which are sampled are read, and new entries never 
+    modify the saved memory.
+
+    :param: directory: The directory containing the memory
+    :param: mmap_mode: The numpy memory-map mode, or None to read the arrays into memory
+    :return: memory: The CompactSequentialMemory or PrioritizedCompactMemory
+    """
+
+    memory_info = pickle.load( open(os.path.join(directory, "memory_info.p"), "rb" ) )
+
+    if os.path.exists(os.path.join(directory, "priority_info.p")):
+        priority_info = pickle.load( open(os.path.join(directory, "priority_info.p"), "rb" ) )
+        memory = PrioritizedCompactMemory(memory_info["limit"], memory_info["window_length"], memory_info["ignore_episode_boundaries"],
+                                          memory_info["volume_depth"], priority_info["alpha"], priority_info["epsilon"],
+                                          priority_info.get("beta", 0.4), priority_info.get("beta_annealing_steps", 1000000))
+        memory.max_priority = priority_info["max_priority"]
+        memory.priorities.update(np.arange(memory.limit), np.load(os.path.join(directory, "priorities.npy")))
+    else:
+        memory = CompactSequentialMemory(memory_info["limit"], memory_info["window_length"], memory_info["ignore_episode_boundaries"],
+                                         memory_info["volume_depth"])
+    memory.actions = np.load(os.path.join(directory, "actions.npy"), mmap_mode=mmap_mode)
+    memory.rewards = np.load(os.path.join(directory, "rewards.npy"), mmap_mode=mmap_mode)
+    memory.terminals = np.load(os.path.join(directory, "terminals.npy"), mmap_mode=mmap_mode)
+    memory.observation_shape = memory_info["observation_shape"]
+    if memory.observation_shape is not None and memory.volume_depth is None:
+        memory.observations = np.load(os.path.join(directory, "observations.npy"), mmap_mode=mmap_mode)
+    elif memory.observation_shape is not None:
+        memory.volumes = np.load(os.path.join(directory, "volumes.npy"), mmap_mode=mmap_mode)
+        memory.volume_ids = np.load(os.path.join(directory, "volume_ids.npy"), mmap_mode=mmap_mode)
+        memory.action_histories = np.load(os.path.join(directory, "action_histories.npy"), mmap_mode=mmap_mode)
+    memory.next_index = memory_info["next_index"]
+    memory.nb_entries = memory_info["nb_entries"]
+    memory.next_volume_index = memory_info["next_volume_index"]
+
+    return memory
+
+class SumTree():
+    """"
+    An array-based sum tree over a fixed number of priorities, in which every internal node holds the sum of its two children. This
+    allows both updating priorities and sampling indices proportionally to their priority in O(log(capacity)), for whole batches at once.
+
+    :param: capacity: The number of priorities
+    """
+
+    def __init__(self, capacity):
+
+        # The number of leaves is rounded up to a power of two, so that all the leaves are at the same depth and in order
+        self.capacity = capacity
+        self.nb_leaves = 1
+        while self.nb_leaves < capacity:
+            self.nb_leaves *= 2
+        self.tree = np.zeros(2*self.nb_leaves - 1)
+
+    def total(self):
+        """"
+        Returns the sum of all the priorities.
+        """
+
+        return self.tree[0]
+
+    def get(self, indices):
+        """"
+        Returns the priorities at the given indices.
+        """
+
+        return self.tree[np.asarray(indices) + self.nb_leaves - 1]
+
+    def update(self, indices, priorities):
+        """"
+        Sets the priorities at the given indices, and updates the sums of all their ancestors.
+
+        :param: indices: An array of indices
+        :param: priorities: An array of the corresponding new priorities
+        """
+
+        nodes = np.asarray(indices, int) + self.nb_leaves - 1
+        self.tree[nodes] = priorities
+
+        # Recompute all the ancestors from their children, level by level
+        nodes = np.unique((nodes[nodes > 0] - 1)//2)
+        while len(nodes) > 0:
+            self.tree[nodes] = self.tree[2*nodes + 1] + self.tree[2*nodes + 2]
+            nodes = np.unique((nodes[nodes > 0] - 1)//2)
+
+    def find(self, values):
+        """"
+        Returns, for each value, the index whose cumulative priority range contains that value.
+
+        :param: values: An array of values between 0 and the total priority
+        :return: indices: The array of corresponding indices
+        """
+
+        values = np.array(values, float)
+        nodes = np.zeros(len(values), int)
+
+        internal = nodes < self.nb_leaves - 1
+        while np.any(internal):
+            left_children = 2*nodes[internal] + 1
+            left_sums = self.tree[left_children]
+            go_right = values[internal] > left_sums
+            values[internal] = np.where(go_right, values[internal] - left_sums, values[internal])
+            nodes[internal] = np.where(go_right, left_children + 1, left_children)
+            internal = nodes < self.nb_leaves - 1
+
+        return nodes - (self.nb_leaves - 1)
+
+class PrioritizedCompactMemory(CompactSequentialMemory):
+    """"
+    A CompactSequentialMemory from which transitions can be sampled proportionally to a priority, instead of uniformly, so that rare
+    transitions with a large temporal difference error - such as the terminal transitions at low error rates - are replayed much
+    more often. The priorities are kept in a SumTree, and new transitions receive the largest priority seen so far. 
+
+    Prioritized batches are drawn with sample_prioritized, which also returns the importance sampling weights correcting for the 
+    non-uniform sampling, and the priorities are refreshed with update_priorities from the temporal difference errors of the 
+    update. Both are done by the agents built with prioritized_dqn_agent. The strength of the correction, beta, is annealed
+    linearly from its initial value to 1 over beta_annealing_steps agent steps, so that the updates are unbiased by the end of
+    training. The plain sample method of keras-rl agents samples uniformly.
+
+    :param: limit: The maximum number of entries in the memory
+    :param: window_length: The number of consecutive observations forming a state
+    :param: ignore_episode_boundaries: Whether states may contain observations from different episodes
+    :param: volume_depth: The number of syndrome slices at the start of each observation, to store each syndrome volume only once
+    :param: alpha: The exponent with which temporal difference errors are turned into priorities - 0 corresponds to uniform sampling
+    :param: epsilon: The offset added to the absolute temporal difference errors, so that no transition has vanishing priority
+    :param: beta: The initial exponent of the importance sampling weights - 0 corresponds to no correction
+    :param: beta_annealing_steps: The number of agent steps over which beta is annealed to 1
+    """
+
+    def __init__(self, limit, window_length=1, ignore_episode_boundaries=False, volume_depth=None, alpha=0.6, epsilon=0.01,
+                 beta=0.4, beta_annealing_steps=1000000):
+
+        CompactSequentialMemory.__init__(self, limit, window_length, ignore_episode_boundaries, volume_depth)
+
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.beta = beta
+        self.beta_annealing_steps = beta_annealing_steps
+        self.max_priority = 1.0
+        self.priorities = SumTree(limit)
+
+    def append(self, observation, action, reward, terminal, training=True):
+        """"
+        Adds an entry to the memory. The transition from the previous entry is only complete once its next observation is stored, and
+        only then can it be sampled - unless the entry before it ended an episode, in which case it never can.
+        """
+
+        if training:
+            if self.nb_entries > 0:
+                previous_index = (self.next_index - 1) % self.limit
+                if self.get_terminal(self.nb_entries - 2):
+                    self.priorities.update([previous_index], [0.0])
+                else:
+                    self.priorities.update([previous_index], [self.max_priority])
+            self.priorities.update([self.next_index], [0.0])
+
+        CompactSequentialMemory.append(self, observation, action, reward, terminal, training)
+
+    def sample_prioritized(self, batch_size, step):
+        """"
+        Samples a batch of experiences proportionally to their priorities.
+
+        :param: batch_size: The number of experiences
+        :param: step: The current step of the agent, from which the exponent beta of the importance sampling weights is set
+        :return: experiences: A list of Experience tuples
+        :return: physical_indices: The positions of the sampled transitions in the ring arrays, for update_priorities
+        :return: weights: The importance sampling weights of the experiences, normalized to a maximum of 1
+        """
+
+        total = self.priorities.total()
+        if total <= 0:
+            raise Exception("not enough entries in the memory to sample from!")
+
+        # Stratified sampling of the cumulative priorities
+        physical_indices = self.priorities.find((np.arange(batch_size) + np.random.random(batch_size))*total/batch_size)
+        vanishing = self.priorities.get(physical_indices) <= 0
+        while np.any(vanishing):
+            physical_indices[vanishing] = self.priorities.find(np.random.random(np.sum(vanishing))*total)
+            vanishing = self.priorities.get(physical_indices) <= 0
+
+        batch_idxs = (physical_indices - (self.next_index - self.nb_entries)) % self.limit
+        experiences = CompactSequentialMemory.sample(self, batch_size, batch_idxs)
+
+        beta = self.beta + (1.0 - self.beta)*min(1.0, step/self.beta_annealing_steps)
+        weights = (self.nb_entries*self.priorities.get(physical_indices)/total)**(-beta)
+
+        return experiences, physical_indices, weights/np.max(weights)
+
+    def update_priorities(self, physical_indices, td_errors):
+        """"
+        Sets the priorities of transitions from their temporal difference errors.
+
+        :param: physical_indices: The positions of the transitions in the ring arrays
+        :param: td_errors: The temporal difference errors of the transitions
+        """
+
+        priorities = (np.abs(td_errors) + self.epsilon)**self.alpha
+        self.priorities.update(physical_indices, priorities)
+        self.max_priority = max(self.max_priority, float(np.max(priorities)))
+
+    def save(self, directory):
+        """"
+        Saves the memory, including its priorities, into a directory from which it can be memory-mapped with load_compact_memory.
+
+        :param: directory: The directory in which to save the memory
+        """
+
+        CompactSequentialMemory.save(self, directory)
+
+        self.save_arrays(directory, {"priorities": self.priorities.get(np.arange(self.limit))})
+        priority_info = {"alpha": self.alpha, "epsilon": self.epsilon, "beta": self.beta, "beta_annealing_steps": self.beta_annealing_steps,
+                         "max_priority": self.max_priority}
+        pickle.dump(priority_info, open(os.path.join(directory, "priority_info.p"), "wb" ) )
+
+def prioritized_dqn_agent(agent_class):
+    """"
+    This function returns a subclass of the given keras-rl DQNAgent class, which trains from a PrioritizedCompactMemory. Its updates
+    are those of keras-rl, except that the batches are sampled by priority, the loss of each experience is scaled by its importance 
+    sampling weight, and the priorities are refreshed from the temporal difference errors of the update itself. The online Q-values
+    of state0 which these require are computed in the same forward pass as those of state1 for double DQN, so that prioritization
+    costs no additional passes through the networks. The agent class is passed in, so that this library does not depend on keras-rl.
+
+    :param: agent_class: The DQNAgent class
+    :return: PrioritizedDQNAgent: The subclass of agent_class
+    """
+
+    class PrioritizedDQNAgent(agent_class):
+
+        def backward(self, reward, terminal):
+
+            if not isinstance(self.memory, PrioritizedCompactMemory):
+                return agent_class.backward(self, reward, terminal)
+
+            if self.step % self.memory_interval == 0:
+                self.memory.append(self.recent_observation, self.recent_action, reward, terminal, training=self.training)
+
+            metrics = [np.nan for _ in self.metrics_names]
+            if not self.training:
+                return metrics
+
+            if self.step > self.nb_steps_warmup and self.step % self.train_interval == 0:
+                experiences, physical_indices, weights = self.memory.sample_prioritized(self.batch_size, self.step)
+
+                state0_batch = self.process_state_batch([experience.state0 for experience in experiences])
+                state1_batch = self.process_state_batch([experience.state1 for experience in experiences])
+                action_batch = np.array([experience.action for experience in experiences])
+                reward_batch = np.array([experience.reward for experience in experiences])
+                terminal1_batch = np.array([0. if experience.terminal1 else 1. for experience in experiences])
+                batch_range = np.arange(self.batch_size)
+
+                if self.enable_double_dqn:
+                    q_values = self.model.predict_on_batch(np.concatenate([state1_batch, state0_batch]))
+                    q_values0 = q_values[self.batch_size:]
+                    next_actions = np.argmax(q_values[:self.batch_size], axis=1)
+                    q_batch = self.target_model.predict_on_batch(state1_batch)[batch_range, next_actions]
+                else:
+                    q_values0 = self.model.predict_on_batch(state0_batch)
+                    q_batch = np.max(self.target_model.predict_on_batch(state1_batch), axis=1)
+
+                Rs = reward_batch + self.gamma*q_batch*terminal1_batch
+                self.memory.update_priorities(physical_indices, Rs - q_values0[batch_range, action_batch])
+
+                targets = np.zeros((self.batch_size, self.nb_actions), np.float32)
+                masks = np.zeros((self.batch_size, self.nb_actions), np.float32)
+                targets[batch_range, action_batch] = Rs
+                masks[batch_range, action_batch] = 1.
+
+                # The importance sampling weights scale the loss output, the second output only serves the metrics
+                ins = [state0_batch] if type(self.model.input) is not list else state0_batch
+                metrics = self.trainable_model.train_on_batch(ins + [targets, masks], [Rs, targets], 
+                                                              sample_weight=[weights, np.ones(self.batch_size)])
+                metrics = [metric for idx, metric in enumerate(metrics) if idx not in (1, 2)]
+                metrics += self.policy.metrics
+                if self.processor is not None:
+                    metrics += self.processor.metrics
+
+            if self.target_model_update >= 1 and self.step % self.target_model_update == 0:
+                self.update_target_model_hard()
+
+            return metrics
+
+    return PrioritizedDQNAgent
+
+def normal_quantile(q):
+    """"
+    This function returns the q-quantile of the standard normal distribution, obtained by bisection of the error function.
+
+    :param: q: The probability, between 0 and 1
+    :return: z: The value z for which P(Z < z) = q
+    """
+
+    lower, upper = -40.0, 40.0
+    for j in range(100):
+        middle = (lower + upper)/2
+        if 0.5*math.erfc(-middle/math.sqrt(2)) < q:
+            lower = middle
+        else:
+            upper = middle
+    return (lower + upper)/2
+
+def lifetime_confidence_interval(lifetimes, confidence=0.99):
+    """"
+    This function returns the mean of a sample of episode lifetimes, together with a (normal approximation) confidence interval
+    for the average lifetime.
+
+    :param: lifetimes: A list of episode lifetimes
+    :param: confidence: The confidence level of the interval
+    :return: mean: The sample mean of the lifetimes
+    :return: lower: The lower end of the confidence interval
+    :return: upper: The upper end of the confidence interval
+    """
+
+    lifetimes = np.asarray(lifetimes, float)
+    mean = np.mean(lifetimes)
+    if len(lifetimes) < 2:
+        return mean, 0.0, np.inf
+
+    z = normal_quantile(1 - (1 - confidence)/2)
+    half_width = z*np.std(lifetimes, ddof=1)/np.sqrt(len(lifetimes))
+    return mean, mean - half_width, mean + half_width
+
+def sequential_lifetime_test(lifetimes, threshold, confidence=0.99, min_episodes=50, indifference=0.2):
+    """"
+    This function decides, from the episode lifetimes observed so far, whether the average lifetime of a decoder is above or below
+    a given threshold (i.e. the single qubit lifetime 1/p), so that evaluation can stop as soon as the comparison is settled.
+
+    The decision is taken by Wald's sequential probability ratio test, with the lifetimes modelled as exponentially distributed
+    (the discrete lifetimes of a decoder which fails with a constant probability per step are geometric, which for lifetimes of
+    many steps is indistinguishable from exponential). The hypothesis that the average lifetime is threshold*(1 + indifference)
+    is tested against the hypothesis that it is threshold*(1 - indifference), and for average lifetimes within this indifference
+    zone either decision is acceptable. For exactly exponential lifetimes the likelihood ratio is a martingale, so that the 
+    probability of a wrong decision is at most 1 - confidence however often the test is repeated as episodes accumulate. The 
+    lifetimes of a poorly trained decoder may however be far more spread out than exponential, so the log likelihood ratio is 
+    divided by the observed excess dispersion (the squared coefficient of variation, which is one for exponential lifetimes), and
+    no decision is ever taken from fewer than min_episodes episodes. As the dispersion is itself estimated from the lifetimes, the
+    corrected ratio is no longer exactly a martingale, and the error probability of 1 - confidence only holds approximately - in 
+    simulations of strongly skewed (log-normal) lifetimes, wrong decisions at the edge of the indifference zone were a few times 
+    more frequent than 1 - confidence.
+
+    :param: lifetimes: A list of the episode lifetimes observed so far
+    :param: threshold: The average lifetime to compare against
+    :param: confidence: One minus the (approximate) probability of each kind of wrong decision
+    :param: min_episodes: The minimum number of episodes before a decision is taken
+    :param: indifference: The relative distance from the threshold below which either decision is acceptable
+    :return: decision: True if the average lifetime is above the threshold, False if it is below, None if still undecided
+    :return: interval: The (normal approximation) confidence interval (lower, upper) for the average lifetime, for reporting only
+    """
+
+    if not 0 < indifference < 1:
+        raise Exception("indifference must be between 0 and 1!")
+
+    mean, lower, upper = lifetime_confidence_interval(lifetimes, confidence)
+
+    decision = None
+    if len(lifetimes) >= min_episodes:
+        above = threshold*(1 + indifference)
+        below = threshold*(1 - indifference)
+        log_likelihood_ratio = len(lifetimes)*np.log(below/above) + np.sum(lifetimes)*(1/below - 1/above)
+        # Lifetimes more spread out than exponential carry less evidence, so the ratio is deflated by the excess dispersion
+        dispersion = max(1.0, np.var(lifetimes, ddof=1)/mean**2)
+        log_likelihood_ratio /= dispersion
+
+        log_bound = np.log(confidence/(1 - confidence))
+        if log_likelihood_ratio >= log_bound:
+            decision = True
+        elif log_likelihood_ratio <= -log_bound:
+            decision = False
+
+    return decision, (lower, upper)
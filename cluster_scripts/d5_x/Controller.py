@@ -19,9 +19,24 @@ num_best_to_spawn_from = 1
 p_phys_list = [0.001, 0.003, 0.005, 0.007, 0.009, 0.011, 0.013, 0.015, 0.017]
 success_threshold_list = [100000, 100000, 100000, 100000, 100000, 100000, 100000, 100000, 100000]             
 
-# This is the amount of time we give to each simulation before marking it as timed out
+# This is the amount of time we give to the evaluation job which is run after each simulation
+evaluation_time_limit_hours = "04"
+
+# This is the amount of time we give to the training of each simulation before marking it as timed out. The evaluation job
+# is tracked separately: while it waits in the queue we check squeue, and once it has started it gets evaluation_time_limit_hours.
 simulation_time_limit_hours = 14              
 
+def hours_since(start_time):
+    return (now - start_time).total_seconds()/3600.0
+
+def job_is_queued(job_name):
+    # Returns True if a job of the given name is pending or running according to squeue
+    try:
+        output = subprocess.check_output(["squeue", "-h", "-n", job_name, "-o", "%i"])
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return len(output.strip()) > 0
+
 # Grid over which any spawned simulation will run:
 
 learning_starts_list = [1000]
@@ -68,16 +83,25 @@ for config in configs:
         results_dict[str(config)] = results[-1:][0]
         completed_simulations +=1
     else:
-        if "started_at.p" in available_files:
-            # if we know that the simulation started, then we see how long it has been running for
-            sim_start_time = pickle.load(open(folder+"started_at.p", "rb" ))
-            time_diff = now - sim_start_time
-            time_diff_hours = time_diff.seconds/(3600.0)
-            if time_diff_hours > simulation_time_limit_hours:
+        if "evaluation_started_at.p" in available_files:
+            # if the evaluation has started, then we see how long it has been running for
+            evaluation_start_time = pickle.load(open(folder+"evaluation_started_at.p", "rb" ))
+            if hours_since(evaluation_start_time) > int(evaluation_time_limit_hours):
                 results_dict[str(config)] = 0
                 completed_simulations +=1
             else:
+                results_dict[str(config)] = "still evaluating"
+        elif "started_at.p" in available_files:
+            # if we know that the simulation started, then we see how long it has been running for
+            sim_start_time = pickle.load(open(folder+"started_at.p", "rb" ))
+            if hours_since(sim_start_time) <= simulation_time_limit_hours:
                 results_dict[str(config)] = "still running"
+            elif "final_dqn_weights.h5f" in available_files and job_is_queued("eval_"+current_error_rate+"_"+str(config)):
+                # training finished, and the evaluation job is still waiting in the queue
+                results_dict[str(config)] = "waiting for evaluation"
+            else:
+                results_dict[str(config)] = 0
+                completed_simulations +=1
         else:
             results_dict[str(config)] = "not started"
 
@@ -178,6 +202,7 @@ if completed_simulations == num_configs:
 
 
             new_p_phys = p_phys_list[new_p_phys_index]
+            fixed_configs = pickle.load(open(os.path.join(cwd, "fixed_config.p"), "rb" ))
             new_p_phys_directory = os.path.join(cwd,str(new_p_phys)+"/")
 
             text_file = open(history_path, "a")
@@ -222,7 +247,10 @@ if completed_simulations == num_configs:
                                             new_sim_script_path = os.path.join(config_directory, "simulation_script.sh")
 
                                             # Now, write into the bash script exactly what we want to appear there
-                                            python_script = os.path.join(new_p_phys_directory,"Single_Point_Continue_Training_Script.py")
+                                            if fixed_configs["n_actors"] > 0:
+                                                python_script = os.path.join(cwd,"Actor_Learner_Training_Script.py")
+                                            else:
+                                                python_script = os.path.join(new_p_phys_directory,"Single_Point_Continue_Training_Script.py")
                                             job_name=str(new_p_phys)+"_"+str(config_counter)
                                             output_file = os.path.join(new_p_phys_directory,"output_files/out_"+job_name+".out")
                                             error_file = os.path.join(new_p_phys_directory,"output_files/err_"+job_name+".err")
@@ -257,15 +285,54 @@ python {python_script} {config_counter} {new_p_phys_directory}'''.format(job_nam
                                                                            config_counter=config_counter,
                                                                            new_p_phys_directory=new_p_phys_directory))
                                             f.close()
+
+                                            # The evaluation over a sweep of error rates is submitted as a separate job, once training has finished
+                                            new_eval_script_path = os.path.join(config_directory, "evaluation_script.sh")
+                                            evaluation_script = os.path.join(cwd,"Single_Point_Evaluation_Script.py")
+                                            evaluation_job_name = "eval_"+job_name
+                                            evaluation_output_file = os.path.join(new_p_phys_directory,"output_files/out_"+evaluation_job_name+".out")
+                                            evaluation_error_file = os.path.join(new_p_phys_directory,"output_files/err_"+evaluation_job_name+".err")
+
+                                            f = open(new_eval_script_path,"w")
+                                            f.write('''#!/bin/bash
+
+#SBATCH --job-name={job_name}                # Job name, will show up in squeue output
+#SBATCH --ntasks=4                           # Number of cores - one evaluation worker per core
+#SBATCH --nodes=1                            # Ensure that all cores are on one machine
+#SBATCH --time=0-{time_limit}:00:00                    # Runtime in DAYS-HH:MM:SS format
+#SBATCH --mem-per-cpu=1000                   # Memory per cpu in MB (see also --mem) 
+#SBATCH --output={output_file}               # File to which standard out will be written
+#SBATCH --error={error_file}                 # File to which standard err will be written
+
+# store job info in output file, if you want...
+scontrol show job $SLURM_JOBID
+
+
+# ---------------------- JOB SCRIPT ---------------------------------------------
+
+# ----------- Activate the environment  -----------------------------------------
+
+#module load python/3.6.5
+
+# ------- run the script -----------------------
+
+python {python_script} {config_counter} {new_p_phys_directory} 4'''.format(job_name=evaluation_job_name,
+                                                                           time_limit=evaluation_time_limit_hours,
+                                                                           output_file=evaluation_output_file,
+                                                                           error_file=evaluation_error_file,
+                                                                           python_script=evaluation_script,
+                                                                           config_counter=config_counter,
+                                                                           new_p_phys_directory=new_p_phys_directory))
+                                            f.close()
                                             
                                             # Finally I copy the base neural network that will be loaded into that folder
                                             source_weights = os.path.join(check_directory,"config_"+spawn+"/final_dqn_weights.h5f")
                                             destination_weights = os.path.join(config_directory,"initial_dqn_weights.h5f")
                                             copyfile(source_weights, destination_weights)
 
-                                            source_memory = os.path.join(check_directory,"config_"+spawn+"/memory.p")
-                                            destination_memory = os.path.join(config_directory,"memory.p")
-                                            copyfile(source_memory, destination_memory)
+                                            source_memory = os.path.join(check_directory,"config_"+spawn+"/memory")
+                                            destination_memory = os.path.join(config_directory,"memory")
+                                            shutil.copytree(source_memory, destination_memory)
 
                                             config_counter += 1 
                                         
@@ -0,0 +1,232 @@
+# ------------ This script evaluates a trained agent for a single configuration point over a sweep of error rates ----------------
+#
+# usage: python Single_Point_Evaluation_Script.py config_number p_phys_directory [num_workers]
+#
+# The final weights of "p_phys_directory/config_x/" are tested at the error rates 0.001, 0.002, ... until the average qubit lifetime
+# falls below the single qubit lifetime 1/p. The error rates are fanned out over a pool of worker processes, each of which builds
+# the agent and loads the weights only once. Results are written into "all_results.p" as soon as they are available, and the
+# result at the error rate the agent was trained at is written into "results.p", which is what the Controller waits for.
+#
+# At each error rate at most testing_length episodes are run. Testing stops earlier, though never before testing_min_episodes
+# episodes, as soon as a sequential probability ratio test settles whether the average lifetime is above or below 1/p, with a
+# probability of a wrong decision of roughly 1 - testing_confidence. The (normal approximation) confidence intervals for the
+# average lifetime reached, the number of episodes and the decision of the test are written into "all_results_intervals.p".
+# The sweep stops at the first error rate at which the test decides that the agent does not beat 1/p - or, if the test is
+# still undecided after testing_length episodes, at which the average lifetime is below 1/p.
+
+import os
+import sys
+import pickle
+import datetime
+import multiprocessing
+
+from Function_Library import *
+
+# ---------------------------------------------------------------------------------------------
+
+def build_convolutional_nn(cc_layers,ff_layers, input_shape, num_actions):
+
+    from keras.models import Sequential
+    from keras.layers import Dense, Dropout, Activation, Flatten, Conv2D
+
+    # cc_layers =[num_filters, kernel_size,strides]
+
+    model = Sequential()
+    model.add(Conv2D(filters=cc_layers[0][0],
+                     kernel_size=cc_layers[0][1],
+                     strides=cc_layers[0][2],
+                     input_shape=input_shape,
+                     data_format='channels_first'))
+    model.add(Activation('relu'))
+
+    for j in range(1,len(cc_layers)):
+            model.add(Conv2D(filters=cc_layers[j][0],
+                     kernel_size=cc_layers[j][1],
+                     strides=cc_layers[j][2],
+                     data_format='channels_first'))
+            model.add(Activation('relu'))
+
+    model.add(Flatten())
+
+    for j in range(len(ff_layers)):
+        model.add(Dense(ff_layers[j][0]))
+        model.add(Activation('relu'))
+        model.add(Dropout(rate=ff_layers[j][1]))
+
+    model.add(Dense(num_actions))
+    model.add(Activation('linear'))
+
+    return model
+
+# ---------------------------------------------------------------------------------------------
+
+def initialize_worker(all_configs, variable_configs_folder, base_directory):
+    """"
+    Builds the environment and the trained agent of a worker process. This is done once per worker, so that every error
+    rate evaluated by the worker reuses the same agent. Keras is only imported here, so that the parent process never
+    initializes the backend.
+
+    :param: all_configs: The dictionary containing both the fixed and variable configuration of this point
+    :param: variable_configs_folder: The folder containing the final weights of the agent
+    :param: base_directory: The error rate directory, which is one level below the referee decoder
+    """
+
+    global env, dqn, nb_test_episodes, testing_confidence, testing_min_episodes, lifetime_recorder
+
+    from keras.models import load_model
+    from keras.optimizers import Adam
+    from rl.agents.dqn import DQNAgent
+    from rl.policy import GreedyQPolicy
+    from rl.memory import SequentialMemory
+    from rl.callbacks import Callback
+
+    from Environments import Surface_Code_Environment_Multi_Decoding_Cycles
+
+    if all_configs["static_decoder"] and os.path.exists(os.path.join(base_directory, "../referee_table")):
+      static_decoder = RefereeLookupTable(os.path.join(base_directory, "../referee_table"))
+      if not static_decoder.dense:
+        static_decoder.fallback_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
+    elif all_configs["static_decoder"]:
+      static_decoder = CachedStaticDecoder(load_model(os.path.join(base_directory, "../static_decoder")))
+    else:
+      static_decoder = None
+
+    env = Surface_Code_Environment_Multi_Decoding_Cycles(d=all_configs["d"],
+        p_phys=all_configs["p_phys"],
+        p_meas=all_configs["p_meas"],
+        error_model=all_configs["error_model"],
+        use_Y=all_configs["use_Y"],
+        volume_depth=all_configs["volume_depth"],
+        static_decoder=static_decoder,
+        fast_forward=all_configs.get("fast_forward", True))
+
+    model = build_convolutional_nn(all_configs["c_layers"],all_configs["ff_layers"], env.observation_space.shape, env.num_actions)
+    memory = SequentialMemory(limit=all_configs["buffer_size"], window_length=1)
+    policy = GreedyQPolicy(masked_greedy=True)
+    test_policy = GreedyQPolicy(masked_greedy=True)
+
+    dqn = DQNAgent(model=model,
+                   nb_actions=env.num_actions,
+                   memory=memory,
+                   nb_steps_warmup=all_configs["learning_starts"],
+                   target_model_update=all_configs["target_network_update_freq"],
+                   policy=policy,
+                   test_policy=test_policy,
+                   gamma = all_configs["gamma"],
+                   enable_dueling_network=all_configs["dueling"])
+
+    dqn.compile(Adam(lr=all_configs["learning_rate"]))
+    dqn.model.load_weights(os.path.join(variable_configs_folder, "final_dqn_weights.h5f"))
+
+    nb_test_episodes = all_configs["testing_length"]
+    testing_confidence = all_configs.get("testing_confidence", 0.99)
+    testing_min_episodes = all_configs.get("testing_min_episodes", 50)
+
+    class LifetimeRecorder(Callback):
+        # Records the lifetime of every test episode
+        def __init__(self):
+            self.lifetimes = []
+        def on_episode_end(self, episode, logs={}):
+            self.lifetimes.append(self.env.lifetime)
+
+    lifetime_recorder = LifetimeRecorder()
+
+
+def evaluate_error_rate(err_rate, test_interval=10):
+    """"
+    Tests the agent of this worker at a single error rate. Episodes are run in groups of test_interval, until either the 
+    comparison of the average lifetime against the single qubit lifetime is statistically settled, or nb_test_episodes 
+    episodes have been run.
+
+    :param: err_rate: The physical and measurement error rate at which to test
+    :param: test_interval: The number of episodes between successive checks of the sequential test
+    :return: err_rate: The error rate at which the agent was tested
+    :return: results: The running average of the episode lifetimes during testing
+    :return: interval: The confidence interval for the average lifetime, and the number of episodes it was obtained from
+    :return: decision: True if the average lifetime is above 1/err_rate, False if it is below, None if the test stayed undecided
+    """
+
+    env.p_phys = err_rate
+    env.p_meas = err_rate
+    lifetime_recorder.lifetimes = []
+
+    decision = None
+    while decision is None and len(lifetime_recorder.lifetimes) < nb_test_episodes:
+        nb_episodes = min(test_interval, nb_test_episodes - len(lifetime_recorder.lifetimes))
+        dqn.test(env,nb_episodes = nb_episodes, visualize=False, verbose=0, callbacks=[lifetime_recorder], single_cycle=False)
+        decision, interval = sequential_lifetime_test(lifetime_recorder.lifetimes, 1/err_rate, testing_confidence, testing_min_episodes)
+
+    lifetimes = np.array(lifetime_recorder.lifetimes, float)
+    results = list(np.cumsum(lifetimes)/np.arange(1, len(lifetimes) + 1))
+
+    return err_rate, results, (interval[0], interval[1], len(lifetimes)), decision
+
+# ---------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    variable_config_number = sys.argv[1]
+    base_directory = sys.argv[2]
+    if len(sys.argv) > 3:
+        num_workers = int(sys.argv[3])
+    else:
+        num_workers = int(os.environ.get("SLURM_NTASKS", multiprocessing.cpu_count()))
+
+    variable_configs_folder = os.path.join(base_directory, "./config_"+str(variable_config_number) + "/")
+    variable_configs_path = os.path.join(variable_configs_folder, "variable_config_"+variable_config_number + ".p" )
+    fixed_configs_path = os.path.join(base_directory, "../fixed_config.p")
+
+    fixed_configs = pickle.load( open(fixed_configs_path, "rb" ) )
+    variable_configs = pickle.load( open(variable_configs_path, "rb" ) )
+
+    all_configs = {}
+
+    for key in fixed_configs.keys():
+        all_configs[key] = fixed_configs[key]
+
+    for key in variable_configs.keys():
+        all_configs[key] = variable_configs[key]
+
+    # -------------------------------------------------------------------------------------------
+
+    # The Controller tracks the evaluation job from the moment it starts
+    pickle.dump(datetime.datetime.now(), open(os.path.join(variable_configs_folder,"evaluation_started_at.p"), "wb" ))
+
+    trained_at = all_configs["p_phys"]
+    num_to_test = 20
+    error_rates = [j*0.001 for j in range(1,num_to_test + 1)]
+    thresholds = [1/p for p in error_rates]
+    all_results = {}
+    all_intervals = {}
+
+    all_results_file = os.path.join(variable_configs_folder,"all_results.p")
+    all_intervals_file = os.path.join(variable_configs_folder,"all_results_intervals.p")
+    results_file = os.path.join(variable_configs_folder,"results.p")
+
+    # The workers are spawned rather than forked, so that each of them initializes its own Keras backend
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(processes=max(1, min(num_workers, num_to_test)),
+        initializer=initialize_worker,
+        initargs=(all_configs, variable_configs_folder, base_directory))
+
+    # The error rates are handed out in increasing order and the results are collected in the same order, so that the
+    # sweep stops at the first error rate at which the agent no longer beats the single qubit lifetime
+    for count, (err_rate, results, interval, decision) in enumerate(pool.imap(evaluate_error_rate, error_rates)):
+
+      dict_key = str(err_rate)[:5]
+      final_result = results[-1:][0]
+      all_results[dict_key] = final_result
+      all_intervals[dict_key] = interval + (decision,)
+      pickle.dump(all_results, open(all_results_file, "wb" ))
+      pickle.dump(all_intervals, open(all_intervals_file, "wb" ))
+
+      if abs(trained_at - err_rate) < 1e-6:
+        pickle.dump(results, open(results_file, "wb" ))
+
+      # The sample mean only decides when the sequential test could not
+      to_beat = thresholds[count]
+      if decision is False or (decision is None and final_result < to_beat):
+        break
+
+    pool.terminate()
+    pool.join()
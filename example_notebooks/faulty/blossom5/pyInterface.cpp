@@ -1,83 +1,91 @@
 #include <stdio.h>
+#include <atomic>
+#include <thread>
+#include <vector>
 #include "PerfectMatching.h"
 #include "GEOM/GeomPerfectMatching.h"
 
 
 
-extern "C" {
-
-int* pyMatching(int node_num, int edge_num, int nodes1[], int nodes2[], int weights[])
+// Solve a single graph, writing the node matched to each node into out[0..node_num-1]
+static void solveMatching(int node_num, int edge_num, const int nodes1[], const int nodes2[], const int weights[], int out[])
 {
-	
+	if (node_num == 0) return;
+
 	struct PerfectMatching::Options options;
-	
-	char* filename = NULL;
-	bool check_perfect_matching = false;
-	//int i, e, node_num, edge_num;
-	int* edges;
-	
-	//int edge_num=sizeof(*nodes1);
-	//printf("%d\n" sizeof(nodes1));
-	//edges=
-
-	
-	//printf("%d %d\n",node_num,edge_num);
-	
-	//print the input
-//	for(int k=0; k<edge_num; ++k)
-//	{
-//		printf("%d %d %d \n",nodes1[k],nodes2[k],weights[k]);
-//	}
-
-	
+
 	PerfectMatching *pm = new PerfectMatching(node_num,edge_num);
-	
-	for(int k=0; k<edge_num;++k)	
+
+	for(int k=0; k<edge_num;++k)
 	{
 		pm->AddEdge(nodes1[k],nodes2[k],weights[k]);
 	}
 
+	// Blossom V must not print, since several graphs may be solved at once from different threads
+	options.verbose = false;
 	pm->options = options;
 	pm->Solve();
-;
 
-	int i, j;
-	int* out = new int[node_num];
-	for (i=0; i<node_num; i++)
+	for (int i=0; i<node_num; i++)
 	{
-		j = pm->GetMatch(i);
-		out[i]=j;
-		//if (i < j) printf("%d %d\n", i, j);
+		out[i] = pm->GetMatch(i);
 	}
 
+	delete pm;
+}
 
 
-	
 
+extern "C" {
 
+// The matching of a single graph is written into the caller provided buffer out, of length node_num
+void pyMatching(int node_num, int edge_num, int nodes1[], int nodes2[], int weights[], int out[])
+{
+	solveMatching(node_num, edge_num, nodes1, nodes2, weights, out);
+}
 
 
-//	if (check_perfect_matching)
-//	{
-//		int res = CheckPerfectMatchingOptimality(node_num, //edge_num, edges, weights, pm);
-//		printf("check optimality: res=%d (%s)\n", res, (res==0) ? "ok" : ((res==1) ? "error" : "fatal error"));
-//	}
 
-//	double cost = ComputePerfectMatchingCost(node_num, edge_num, edges, weights, pm);
-//	printf("cost = %.1f\n", cost);
-	//if (save_filename) SaveMatching(node_num, pm, save_filename);
-	delete pm;
-	
-	if (filename)
+// Matches num_graphs independent graphs in a single call. The graphs are concatenated CSR style: the edges of graph g are
+// nodes1/nodes2/weights[edge_offsets[g]..edge_offsets[g+1]-1], with node indices local to the graph, and its matching
+// (again with local node indices) is written into out[node_offsets[g]..node_offsets[g+1]-1]. Both offset arrays have
+// num_graphs+1 entries. The graphs are solved by num_threads threads, where num_threads < 1 uses all hardware threads.
+void pyMatchingBatch(int num_graphs, int node_offsets[], int edge_offsets[], int nodes1[], int nodes2[], int weights[], int out[], int num_threads)
+{
+	if (num_threads < 1)
 	{
-		delete [] edges;
-		delete [] weights;
+		num_threads = (int) std::thread::hardware_concurrency();
+		if (num_threads < 1) num_threads = 1;
 	}
-	
+	if (num_threads > num_graphs) num_threads = num_graphs;
 
+	// The threads take the next unsolved graph until none are left, which balances graphs of different sizes
+	std::atomic<int> next_graph(0);
+	auto solveGraphs = [&]()
+	{
+		for (int g=next_graph++; g<num_graphs; g=next_graph++)
+		{
+			int e0 = edge_offsets[g];
+			solveMatching(node_offsets[g+1] - node_offsets[g], edge_offsets[g+1] - e0,
+			              nodes1 + e0, nodes2 + e0, weights + e0, out + node_offsets[g]);
+		}
+	};
+
+	if (num_threads <= 1)
+	{
+		solveGraphs();
+		return;
+	}
 
-	
-	return out;
+	std::vector<std::thread> threads;
+	for (int t=0; t<num_threads; t++)
+	{
+		threads.push_back(std::thread(solveGraphs));
+	}
+	for (int t=0; t<num_threads; t++)
+	{
+		threads[t].join();
+	}
 }
 
 }
@@ -1,78 +1,123 @@
 import ctypes
+import numpy as np
 from numpy.ctypeslib import ndpointer
 import os
-import time
 
 
 
-def getMatching_fast(numNodes,nodes1, nodes2, weights):
-	
-	numEdges=len(nodes1);
+class Matcher(object):
 
-	PMlib=ctypes.CDLL("%s/PMlib.so"%"/".join((os.path.realpath(__file__)).split("/")[:-1]))
+	""" Interface to the Blossom V minimum weight perfect matching library PMlib.so
 
-	PMlib.pyMatching.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.POINTER(ctypes.c_int),ctypes.POINTER(ctypes.c_int),ctypes.POINTER(ctypes.c_int)]
+	The library is loaded and its signature configured only once, on the first matching. The edge lists are
+	handed to the library as contiguous int32 arrays - arrays which are already of this form are passed without copying.
 
+	"""
 
-	PMlib.pyMatching.restype = ndpointer(dtype=ctypes.c_int, shape=(numNodes,))
+	def __init__(self, library_path=None):
 
-# initialize ctypes array and fill with edge data
-	n1=(ctypes.c_int*numEdges)();
-	n2=(ctypes.c_int*numEdges)();
-	w=(ctypes.c_int*numEdges)();
+		if library_path is None:
+			library_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "PMlib.so")
 
-	for i in range(numEdges):
-		n1[i],n2[i],w[i]=nodes1[i],nodes2[i],weights[i]
+		self.library_path = library_path
+		self.PMlib = None
 
-	result=PMlib.pyMatching(ctypes.c_int(numNodes),ctypes.c_int(numEdges),n1,n2,w)
 
-	return result
+	def load(self):
 
+		if self.PMlib is None:
+			PMlib = ctypes.CDLL(self.library_path)
 
+			int_array = ndpointer(dtype=np.int32, ndim=1, flags="C_CONTIGUOUS")
+			PMlib.pyMatching.argtypes = [ctypes.c_int, ctypes.c_int, int_array, int_array, int_array, int_array]
+			PMlib.pyMatching.restype = None
+			PMlib.pyMatchingBatch.argtypes = [ctypes.c_int, int_array, int_array, int_array, int_array, int_array, int_array, ctypes.c_int]
+			PMlib.pyMatchingBatch.restype = None
 
+			self.PMlib = PMlib
 
+		return self.PMlib
 
 
-def getMatching(numNodes,graphArray):
-	
-	mtime0 = time.time()
+	def match(self, numNodes, nodes1, nodes2, weights):
+
+		""" Returns an array of length numNodes, holding the node each node is matched to """
+
+		PMlib = self.load()
+
+		nodes1 = np.ascontiguousarray(nodes1, dtype=np.int32)
+		nodes2 = np.ascontiguousarray(nodes2, dtype=np.int32)
+		weights = np.ascontiguousarray(weights, dtype=np.int32)
+
+		matching = np.empty(numNodes, dtype=np.int32)
+		PMlib.pyMatching(numNodes, len(nodes1), nodes1, nodes2, weights, matching)
+
+		return matching
+
+
+	def match_batch(self, node_offsets, edge_offsets, nodes1, nodes2, weights, num_threads=1, out=None):
+
+		""" Matches many graphs in a single call to the library, see getMatching_batch """
+
+		PMlib = self.load()
+
+		node_offsets = np.ascontiguousarray(node_offsets, dtype=np.int32)
+		edge_offsets = np.ascontiguousarray(edge_offsets, dtype=np.int32)
+		nodes1 = np.ascontiguousarray(nodes1, dtype=np.int32)
+		nodes2 = np.ascontiguousarray(nodes2, dtype=np.int32)
+		weights = np.ascontiguousarray(weights, dtype=np.int32)
 
-	numEdges=len(graphArray);
-	
-	
+		num_graphs = len(node_offsets) - 1
+		if len(edge_offsets) != num_graphs + 1 or num_graphs < 0:
+			raise Exception("node_offsets and edge_offsets must both contain one entry more than there are graphs!")
+		if node_offsets[0] != 0 or edge_offsets[0] != 0 or np.any(np.diff(node_offsets) < 0) or np.any(np.diff(edge_offsets) < 0):
+			raise Exception("the offsets must start at 0 and be non-decreasing!")
+		if not (len(nodes1) == len(nodes2) == len(weights) == edge_offsets[-1]):
+			raise Exception("the edge arrays must contain edge_offsets[-1] edges!")
 
-	PMlib=ctypes.CDLL("%s/PMlib.so"%"/".join((os.path.realpath(__file__)).split("/")[:-1]))
+		if out is None:
+			out = np.empty(node_offsets[-1], dtype=np.int32)
+		elif out.dtype != np.int32 or not out.flags["C_CONTIGUOUS"] or len(out) != node_offsets[-1]:
+			raise Exception("out must be a contiguous int32 array of length node_offsets[-1]!")
 
-	PMlib.pyMatching.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.POINTER(ctypes.c_int),ctypes.POINTER(ctypes.c_int),ctypes.POINTER(ctypes.c_int)]
+		if num_graphs > 0:
+			PMlib.pyMatchingBatch(num_graphs, node_offsets, edge_offsets, nodes1, nodes2, weights, out, num_threads)
 
+		return out
 
-	PMlib.pyMatching.restype = ndpointer(dtype=ctypes.c_int, shape=(numNodes,))
 
-# initialize ctypes array and fill with edge data
-	nodes1=(ctypes.c_int*numEdges)();
-	nodes2=(ctypes.c_int*numEdges)();
-	weights=(ctypes.c_int*numEdges)();
 
-	#c_int_array = ctypes.c_int*numEdges
-	
-#	nodes1 = c_int_array(*[graphArray[i][0] for i in range(numEdges)])
+matcher = Matcher()
 
 
-	for i in range(numEdges):
-		nodes1[i]=graphArray[i][0]
-		nodes2[i]=graphArray[i][1]
-		weights[i]=graphArray[i][2]
 
-	
+def getMatching_fast(numNodes,nodes1, nodes2, weights):
+
+	return matcher.match(numNodes, nodes1, nodes2, weights)
+
+
+
+def getMatching_batch(node_offsets, edge_offsets, nodes1, nodes2, weights, num_threads=1, out=None):
+
+	""" Finds the minimum weight perfect matchings of many graphs with a single call to the library
 
-#	mtime1 = time.time()
-#	print "matching overhead = ", mtime1-mtime0
+	The graphs are concatenated: the edges of graph g are nodes1/nodes2/weights[edge_offsets[g]:edge_offsets[g+1]], with node
+	indices local to the graph, and graph g has node_offsets[g+1]-node_offsets[g] nodes. The matching of graph g, in local
+	node indices, is returned in out[node_offsets[g]:node_offsets[g+1]]. The graphs are solved by num_threads threads, where
+	num_threads < 1 uses all available hardware threads. Optionally a contiguous int32 buffer out can be given to write into.
+
+	"""
+
+	return matcher.match_batch(node_offsets, edge_offsets, nodes1, nodes2, weights, num_threads, out)
+
+
+
+def getMatching(numNodes,graphArray):
 
-	result=PMlib.pyMatching(ctypes.c_int(numNodes),ctypes.c_int(numEdges),nodes1,nodes2,weights)
+	# the rows of graphArray are [node1, node2, weight]
+	edges = np.ascontiguousarray(np.reshape(np.asarray(graphArray, dtype=np.int32), (-1, 3)).T)
 
-#	mtime2 = time.time()
-#	print "matching time = ",mtime2 - mtime1
-	return result
+	return matcher.match(numNodes, edges[0], edges[1], edges[2])
 
 
 
@@ -93,14 +138,14 @@ def getMatching(numNodes,graphArray):
 # GEOM/GPMinit.o
 # GEOM/GPMinterface.o
 # GEOM/GPMkdtree.o
-# GEOM/GPMmain.o 
+# GEOM/GPMmain.o
 
-#compile all these files as: 
+#compile all these files as:
 
 # g++ -c -fPIC filename.cpp -lrt
 
 # then compile all .o files into a shared library
 
-# g++ -shared filename1.o filename2.o .... -o PMlib.so -lrt
+# g++ -shared filename1.o filename2.o .... -o PMlib.so -lrt -lpthread
 
-# NOTE: the -lrt must come AFTER the filename
+# NOTE: the -lrt -lpthread must come AFTER the filename
@@ -1,9 +1,11 @@
 import random
 import os
+import sys
 import csv
 import subprocess
 import time
 import copy
+import numpy as np
 
 import blossom5.pyMatch as pm
 
@@ -14,6 +16,42 @@ import blossom5.pyMatch as pm
 ## to perform minimum weight matching.
 
 
+_distance_tables = {}
+
+def planar_distance_table(lattice_size):
+
+    """ Returns the table of coordinate distances |p-q| for p,q in -1,...,2*lattice_size+1, indexed as [p+1,q+1].
+
+    The table is computed once per lattice size and cached across calls.
+
+    """
+
+    if lattice_size not in _distance_tables:
+        coordinates = np.arange(-1, 2*lattice_size + 2)
+        _distance_tables[lattice_size] = np.abs(coordinates[:, np.newaxis] - coordinates[np.newaxis, :])
+
+    return _distance_tables[lattice_size]
+
+
+def time_window_pairs(times, max_separation):
+
+    """ Returns the pairs i<j of nodes with times[j] - times[i] < max_separation, for non-decreasing times.
+
+    Only the pairs within the time window are generated, in the order i, then j.
+
+    """
+
+    n = len(times)
+    ends = np.searchsorted(times, times + max_separation, side="left")
+    counts = np.maximum(ends - np.arange(1, n + 1), 0)
+
+    i = np.repeat(np.arange(n), counts)
+    starts = np.cumsum(counts) - counts
+    j = i + 1 + np.arange(len(i)) - np.repeat(starts, counts)
+
+    return i, j
+
+
 def match_planar_3D(lattice_size,stabilizer_type,anyon_positions,time_space_weights=[1,1],boundary_weight = -1 ,print_graph=False):
 
     """ Finds a matching to fix the errors in a 3D planar code given the positions of '-1' stabilizer outcomes
@@ -34,10 +72,10 @@ def match_planar_3D(lattice_size,stabilizer_type,anyon_positions,time_space_weig
     """
 
     max_time_separation = 15  # This determines the maximum time separation of edges that are added to the graph
+    max_boundary_time_separation = 5  # This determines the maximum time separation of edges between boundary nodes
     [wS,wT]=time_space_weights
     wB = wS if boundary_weight == -1 else boundary_weight #if boundary weight not specifiedm, let wB=wS
 
-    total_time=len(anyon_positions)
     nodes_list=[item for sublist in anyon_positions for item in sublist]
     n_nodes=len(nodes_list)
 
@@ -45,98 +83,49 @@ def match_planar_3D(lattice_size,stabilizer_type,anyon_positions,time_space_weig
     if n_nodes==0:
         return []
 
-    node_index=[]
-    count=0
-
-    for x in anyon_positions:
-        node_index+=[[count+i for i in range(len(x))]]
-        count+=len(x)
-
-    b_node_index=[[index+n_nodes for index in t] for t in node_index]
-
-    all_boundary_nodes=[]
-    all_boundary_nodes2=[]
-
-
-    ## LOOKUP TABLES
-
     m = 2*lattice_size +1
 
-
-    weight_lookup={}
-    for p in range(-1,m+1):
-        weight_lookup[p]={}
-        for q in range(-1,m+1):
-            weight_lookup[p][q]=wS*abs(p-q)
+    ## LOOKUP TABLE
+    distance = planar_distance_table(lattice_size)
 
 
     ## CONSTRUCT GRAPH
     ## create a graph containing all possible matchings between pairs of anyons (given constraints)
-    ## This is represented as three lists:
-
-    nodes1 = []
-    nodes2 = []
-    weights = []
-
-    ## PART 1: Complete graph between all real nodes
+    ## This is represented as three contiguous int32 arrays nodes1, nodes2 and weights, built by broadcasting
+    ## over the anyon coordinates. The coordinates are offset by one to index the distance table.
 
-    for i in range(n_nodes -1):
-        (pt,p0,p1)=nodes_list[i]
+    [pt,p0,p1] = np.array(nodes_list, dtype=np.int64).T
 
-        for j in range(i+1,n_nodes):
-            (qt,q0,q1)=nodes_list[j]
+    ## PART 1: Complete graph between all real nodes, up to the maximum time separation
+    ## Anyons are ordered in time, so that only the pairs within the time window need to be generated
 
-            wt=(qt-pt)
-            if wt>=max_time_separation: break
-
-            weight = weight_lookup[q0][p0]+weight_lookup[q1][p1]+wt*wT
-
-            nodes1 +=[i]
-            nodes2 +=[j]
-            weights+=[weight]
+    i_real, j_real = time_window_pairs(pt, max_time_separation)
+    wt = pt[j_real] - pt[i_real]
+    real_weights = wS*(distance[p0[i_real]+1, p0[j_real]+1] + distance[p1[i_real]+1, p1[j_real]+1]) + wT*wt
 
 
     ## PART 2: Generate list of boundary nodes linked to each real node
 
-    boundary_nodes_list = []
-
-    for i in range(n_nodes):
-
-        (pt,p0,p1)=nodes_list[i]
-
-        if stabilizer_type =="star":
-            (bt,b0,b1)=(pt,p0,-1 if p1<lattice_size else m)
-        elif stabilizer_type=="plaquette":
-            (bt,b0,b1)=(pt,-1 if p0<lattice_size else m,p1)
-        else:
-            print("stabilizer_type must be either *star* or *plaquette*")
-            sys.exit(0)
-
-        weight = weight_lookup[p0][b0]+weight_lookup[p1][b1]
-
-        nodes1+=[i]
-        nodes2+=[i+n_nodes]
-        weights+=[int(weight*wB/wS)]
-
-        boundary_nodes_list+=[(bt,b0,b1)]
-
+    if stabilizer_type =="star":
+        (bt,b0,b1)=(pt,p0,np.where(p1<lattice_size,-1,m))
+    elif stabilizer_type=="plaquette":
+        (bt,b0,b1)=(pt,np.where(p0<lattice_size,-1,m),p1)
+    else:
+        print("stabilizer_type must be either *star* or *plaquette*")
+        sys.exit(0)
 
+    boundary_weights = (wS*(distance[p0+1, b0+1] + distance[p1+1, b1+1])*wB/wS).astype(np.int64)
 
- ## PART 3: Complete graph between all boundary nodes
+    boundary_nodes_list = [tuple(b) for b in np.array([bt,b0,b1]).T.tolist()]
 
-    for i in range(n_nodes -1):
-        (pt,p0,p1)=boundary_nodes_list[i]
 
-        for j in range(i+1,n_nodes):
-            (qt,q0,q1)=boundary_nodes_list[j]
-            wt=(qt-pt)
-            if wt>=5: break
+    ## PART 3: Complete graph between all boundary nodes, up to the maximum boundary time separation
 
-            nodes1 +=[n_nodes+i]
-            nodes2 +=[n_nodes+j]
-            weights+=[0]
+    i_boundary, j_boundary = time_window_pairs(bt, max_boundary_time_separation)
 
-    n_edges=len(nodes1)
+    nodes1 = np.concatenate([i_real, np.arange(n_nodes), n_nodes + i_boundary]).astype(np.int32)
+    nodes2 = np.concatenate([j_real, n_nodes + np.arange(n_nodes), n_nodes + j_boundary]).astype(np.int32)
+    weights = np.concatenate([real_weights, boundary_weights, np.zeros(len(i_boundary), np.int64)]).astype(np.int32)
 
 
     ## MAKE MATCHING.
@@ -149,7 +138,8 @@ def match_planar_3D(lattice_size,stabilizer_type,anyon_positions,time_space_weig
     ## REFORMAT MATCHING PAIRS
     ## Take <matching> and turn it into a list of paired anyon positions.
 
-    matching_pairs=[[i,matching[i]] for i in range(2*n_nodes) if matching[i]>i]
+    matched = np.flatnonzero(matching > np.arange(2*n_nodes))
+    matching_pairs=[[i,j] for i,j in zip(matched.tolist(), matching[matched].tolist())]
 
     all_positions=nodes_list+boundary_nodes_list
 
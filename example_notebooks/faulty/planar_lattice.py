@@ -11,9 +11,12 @@ import numpy as np
 """
 
 INFO:
-   Errors stored in an array, each entry represents either
+   Errors stored in a (2*size+1,2*size+1,2) int8 array, each entry represents either
    a qubit: [xError?,zError?] with xError,zError in {1,-1}
-   a stabiliser: star or plaquette depending on location with S in {1,-1}
+   a stabiliser: star or plaquette depending on location, with the value S in {1,-1} stored in both channels
+
+   The supports of the stabilizers are precomputed as index arrays into the flattened array, so that measurements,
+   errors and corrections are applied to all qubits or stabilizers at once.
 
 
 Data structure:
@@ -43,17 +46,35 @@ class PlanarLattice:
     Planar lattice class
     """
 
+    # The positions, masks and stabilizer supports of each size, shared by all lattices of that size
+    _geometries={}
+
     def __init__(self,size):
 
         self.size=size
 
+        self.positions_anyons_S=None
+        self.positions_anyons_P=None
+
+        if size not in PlanarLattice._geometries:
+            PlanarLattice._geometries[size]=self.buildGeometry(size)
+        self.__dict__.update(PlanarLattice._geometries[size])
+
+        ## Initialise array. The array is a view of a flat buffer, whose last two entries are a fixed +1 padding
+
+        self.buffer=np.ones(2*(2*self.size+1)**2+2,dtype=np.int8)
+        self.array=self.buffer[:-2].reshape(2*self.size+1,2*self.size+1,2)
+
+
+    def buildGeometry(self,size):
+        """ computes the positions, masks and stabilizer supports of a lattice of the given size, and returns them
+        as a dictionary of attributes
+        """
+
         self.N_Q=2*size*size+2*size+1
         self.N_full_P=size*(size-1)
         self.N_edge_P=size
 
-        self.positions_anyons_S=None
-        self.positions_anyons_P=None
-
         ## Define basic qubit and stabilizer positions
 
         self.positions_Q=[(x,y) for x in range(2*size+1) for y in range((x%2),2*size+1,2) ]
@@ -85,13 +106,46 @@ class PlanarLattice:
         self.positions_edge_S_B_1=[(2*size,y) for y in range(2*(size%2)+1,2*size,4)]
         self.positions_edge_S_B_2=[(2*size,y) for y in range(2*((size+1)%2)+1,2*size,4)]
 
-        ## Initialise array
+        ## Cells are indexed by x*(2*size+1)+y, and the X (Z) channel of cell k is entry 2*k (2*k+1) of the buffer
+
+        width=2*size+1
+        self.qubit_mask=np.zeros((width,width),dtype=bool)
+        qubit_rows,qubit_cols=np.array(self.positions_Q).T
+        self.qubit_mask[qubit_rows,qubit_cols]=True
+        self.qubit_cells=qubit_rows*width+qubit_cols
+
+        ## Precompute the stabilizer supports, in the order in which the stabilizers are measured
+
+        self.plaquette_cells,self.plaquette_support=self.stabilizer_supports(
+            self.positions_full_P+self.positions_edge_P_L+self.positions_edge_P_R)
+        self.star_cells,self.star_support=self.stabilizer_supports(
+            self.positions_full_S+self.positions_edge_S_T+self.positions_edge_S_B)
 
-        self.array=[[1]*(2*self.size+1) for _ in range(2*self.size+1)]
+        self.logical_x_cells=np.arange(0,width,2)
+        self.logical_z_cells=np.arange(0,width,2)*width
 
-        for p0,p1 in self.positions_Q: self.array[p0][p1]=[1,1]
-        for p0,p1 in self.positions_P: self.array[p0][p1]=1
-        for p0,p1 in self.positions_S: self.array[p0][p1]=1
+        ## The order in which anyons are listed by findAnyons
+
+        self.positions_anyon_S=np.array(self.positions_full_S+[pos for pair in zip(self.positions_edge_S_T,self.positions_edge_S_B) for pos in pair])
+        self.positions_anyon_P=np.array(self.positions_full_P+[pos for pair in zip(self.positions_edge_P_L,self.positions_edge_P_R) for pos in pair])
+
+        return {name:value for name,value in self.__dict__.items() if name not in ["size","positions_anyons_S","positions_anyons_P"]}
+
+
+    def stabilizer_supports(self,positions):
+        """ returns the cells of the given stabilizers, and the cells of their four neighbouring qubits as four arrays.
+        Stabilizers on the edge have only three qubits, their fourth cell is the padding cell past the end of the array,
+        which always holds a neutral +1.
+        """
+
+        width=2*self.size+1
+        rows,cols=np.array(positions).T
+
+        neighbours=np.stack([np.stack([rows,cols-1]),np.stack([rows,cols+1]),np.stack([rows-1,cols]),np.stack([rows+1,cols])],axis=1)
+        inside=np.all((neighbours>=0)&(neighbours<width),axis=0)
+        support=np.where(inside,neighbours[0]*width+neighbours[1],width*width)
+
+        return rows*width+cols,tuple(np.ascontiguousarray(cells) for cells in support)
 
 
 
@@ -105,10 +159,10 @@ class PlanarLattice:
         c=0 if channel=="X" else 1
 
         if arrayType=="errors":
-            print_array=[[x[c] if isinstance(x,list) else 0 for x in row]for row in self.array]
+            print_array=np.where(self.qubit_mask,self.array[:,:,c],0)
 
         if arrayType=="stabilizers":
-            print_array=[[x if isinstance(x,int) else 0 for x in row] for row in self.array]
+            print_array=np.where(self.qubit_mask,0,self.array[:,:,0])
 
 
         plt.imshow(print_array)
@@ -122,19 +176,21 @@ class PlanarLattice:
         else:
             raise ValueError('%s is not a valid channel for showArrayText(), channel must be "X" or "Z '%(channel,))
 
+        width=2*self.size+1
+
         if arrayType in ["error","errors","Errors","Error"]:
 
-            print_array = [[str(x[c]) if isinstance(x,list) else '.' for x in row] for row in self.array]
+            print_array = [[str(self.array[i,j,c]) if self.qubit_mask[i,j] else '.' for j in range(width)] for i in range(width)]
             print_array = [[channel if x=='-1' else x for x in row] for row in print_array]
 
 
         elif arrayType in ["stabilizers","stabs","stabilisers","stabilizer","stabiliser"]:
 
-            print_array = [[str(x) if isinstance(x,int) else '.' for x in row] for row in self.array]
+            print_array = [[str(self.array[i,j,0]) if not self.qubit_mask[i,j] else '.' for j in range(width)] for i in range(width)]
 
         elif arrayType in ["all","both"]:
 
-            print_array = [[str(x[c]) if isinstance(x,list) else ('.' if x==1 else '#') for x in row] for row in self.array]
+            print_array = [[str(self.array[i,j,c]) if self.qubit_mask[i,j] else ('.' if self.array[i,j,0]==1 else '#') for j in range(width)] for i in range(width)]
 
         else:
             raise ValueError('%s is not a valid arrayType for showArrayText()'%(arrayType,))
@@ -151,57 +207,34 @@ class PlanarLattice:
         pZ -- probability of Z error
 
         """
-        for q0,q1 in self.positions_Q:
-            rand1=random.random()
-            rand2=random.random()
+        rand=np.random.rand(2,self.N_Q)
 
-            if rand1<pX:
-                self.array[q0][q1][0]*=-1
-            if rand2<pZ:
-                self.array[q0][q1][1]*=-1
+        self.flipChannels(self.qubit_cells[rand[0]<pX],self.qubit_cells[rand[1]<pZ])
 
 
     def applyRandomErrorsXYZ(self,pX,pY,pZ):
 
-        for p0,p1 in self.positions_Q:
-            if random.random()<pX:
-                self.array[p0][p1][0]*=-1
-            if random.random()<pY:
-                self.array[p0][p1][0]*=-1
-                self.array[p0][p1][1]*=-1
-            if random.random()<pZ:
-                self.array[p0][p1][1]*=-1
+        rand=np.random.rand(3,self.N_Q)
+        flipX=np.logical_xor(rand[0]<pX,rand[1]<pY)
+        flipZ=np.logical_xor(rand[2]<pZ,rand[1]<pY)
 
+        self.flipChannels(self.qubit_cells[flipX],self.qubit_cells[flipZ])
 
 
-    def findAnyons(self):
-
-        anyon_positions_x=[]
-        anyon_positions_z=[]
+    def flipChannels(self,x_cells,z_cells):
+        """ flips the X channel of the qubits in x_cells and the Z channel of the qubits in z_cells """
 
-        for i in range(self.N_full_P):
-            if self.full_S[i]==-1:
-                anyon_positions_x+=[self.positions_full_S[i]]
+        self.buffer[2*x_cells]*=-1
+        self.buffer[2*z_cells+1]*=-1
 
-        for i in range(self.N_edge_P):
-            if self.edge_S_T[i]==-1:
-                anyon_positions_x+=[self.positions_edge_S_T[i]]
-            if self.edge_S_B[i]==-1:
-                anyon_positions_x+=[self.positions_edge_S_B[i]]
 
-        for i in range(self.N_full_P):
-            if self.full_P[i]==-1:
-                anyon_positions_z+=[self.positions_full_P[i]]
-
-        for i in range(self.N_edge_P):
-            if self.edge_P_L[i]==-1:
-                anyon_positions_z+=[self.positions_edge_P_L[i]]
-            if self.edge_P_R[i]==-1:
-                anyon_positions_z+=[self.positions_edge_P_R[i]]
+    def findAnyons(self):
 
+        stars=self.array[self.positions_anyon_S[:,0],self.positions_anyon_S[:,1],0]
+        plaquettes=self.array[self.positions_anyon_P[:,0],self.positions_anyon_P[:,1],0]
 
-        self.positions_anyons_S=anyon_positions_x
-        self.positions_anyons_P=anyon_positions_z
+        self.positions_anyons_S=[tuple(pos) for pos in self.positions_anyon_S[stars==-1].tolist()]
+        self.positions_anyons_P=[tuple(pos) for pos in self.positions_anyon_P[plaquettes==-1].tolist()]
 
 
 
@@ -218,36 +251,26 @@ class PlanarLattice:
         self.array[p0][p1]=stab
 
 
-    def measurePlaquettes(self,pLie=0):
+    def measureStabilizers(self,cells,support,channel,pLie):
+        """ measures all the given stabilizers at once, each of which is flipped with probability pLie """
 
+        values=self.buffer[channel::2]
+        stabs=values[support[0]]*values[support[1]]*values[support[2]]*values[support[3]]
+        if pLie>0:
+            stabs[np.random.rand(len(cells))<pLie]*=-1
 
-        for p0,p1 in self.positions_full_P:
-            stabQubits=((p0,p1-1),(p0,p1+1),(p0-1,p1),(p0+1,p1))
-            self.updateStabilizer(p0,p1,stabQubits,0,pLie)
+        self.buffer[2*cells]=stabs
+        self.buffer[2*cells+1]=stabs
 
-        for p0,p1 in self.positions_edge_P_L:
 
-             stabQubits = ((p0,p1+1),(p0-1,p1),(p0+1,p1))
-             self.updateStabilizer(p0,p1,stabQubits,0,pLie)
+    def measurePlaquettes(self,pLie=0):
 
-        for p0,p1 in self.positions_edge_P_R:
-             stabQubits = ((p0,p1-1),(p0-1,p1),(p0+1,p1))
-             self.updateStabilizer(p0,p1,stabQubits,0,pLie)
+        self.measureStabilizers(self.plaquette_cells,self.plaquette_support,0,pLie)
 
 
     def measureStars(self,pLie=0):
 
-        for p0,p1 in self.positions_full_S:
-            stabQubits=((p0,p1-1),(p0,p1+1),(p0-1,p1),(p0+1,p1))
-            self.updateStabilizer(p0,p1,stabQubits,1,pLie)
-
-        for p0,p1 in self.positions_edge_S_T:
-            stabQubits = ((p0,p1-1),(p0,p1+1),(p0+1,p1))
-            self.updateStabilizer(p0,p1,stabQubits,1,pLie)
-
-        for p0,p1 in self.positions_edge_S_B:
-            stabQubits = ((p0,p1-1),(p0,p1+1),(p0-1,p1))
-            self.updateStabilizer(p0,p1,stabQubits,1,pLie)
+        self.measureStabilizers(self.star_cells,self.star_support,1,pLie)
 
 
     # MEASUREMENT ACCORDING TO AN ERROR VECTOR
@@ -345,21 +368,14 @@ class PlanarLattice:
         c=0 if channel=="X" else 1
 
         # For each qubit, apply a flip to the qubit error channel if needed
-        for (x0,x1) in self.positions_Q:
-            self.array[x0][x1][c]*=flip_array[x0][x1]
+        flips=np.asarray(flip_array,dtype=np.int8).ravel()
+        self.buffer[2*self.qubit_cells+c]*=flips[self.qubit_cells]
 
 
     def measure_logical(self):
 
-        logical_x=1
-        logical_z=1
-        positions_x=[[0,x] for x in range(0,2*self.size+1,2)]
-        positions_z=[[y,0] for y in range(0,2*self.size+1,2)]
-
-        for pos in positions_x:
-            logical_x*=self.array[pos[0]][pos[1]][0]
-        for pos in positions_z:
-            logical_z*=self.array[pos[0]][pos[1]][1]
+        logical_x=1-2*(np.count_nonzero(self.buffer[2*self.logical_x_cells]<0)%2)
+        logical_z=1-2*(np.count_nonzero(self.buffer[2*self.logical_z_cells+1]<0)%2)
 
         return [logical_x,logical_z]
 
@@ -387,13 +403,16 @@ class PlanarLattice:
 
 class PlanarLattice3D:
 
+    # The stabilizer positions of each size, shared by all parity lattices of that size
+    _geometries={}
+
     def __init__(self,size):
 
         self.size=size
         self.N=size*(size+1) # number of stabilizers
 
-        self.syndrome_P=[1]*self.N
-        self.syndrome_S=[1]*self.N
+        self.syndrome_P=np.ones(self.N,dtype=np.int8)
+        self.syndrome_S=np.ones(self.N,dtype=np.int8)
 
         self.parity_array_P=[]
         self.parity_array_S=[]
@@ -402,8 +421,15 @@ class PlanarLattice3D:
 
         self.definite_array_P=[[1]*self.N]
 
-        self.positions_S=[(x,y) for x in range(0,2*size+1,2) for y in range(1,2*size+1,2)];
-        self.positions_P=[(x,y) for x in range(1,2*size+1,2) for y in range(0,2*size+1,2)]
+        if size not in PlanarLattice3D._geometries:
+            positions_S=[(x,y) for x in range(0,2*size+1,2) for y in range(1,2*size+1,2)];
+            positions_P=[(x,y) for x in range(1,2*size+1,2) for y in range(0,2*size+1,2)]
+            # The indices of the X channels of the stabilizer cells in the flattened lattice array
+            S_channels=2*np.array([x*(2*size+1)+y for x,y in positions_S])
+            P_channels=2*np.array([x*(2*size+1)+y for x,y in positions_P])
+            PlanarLattice3D._geometries[size]=(positions_S,positions_P,S_channels,P_channels)
+
+        self.positions_S,self.positions_P,self.S_channels,self.P_channels=PlanarLattice3D._geometries[size]
 
     def getTime(self):
         self.time=len(self.parity_array_P)
@@ -427,55 +453,37 @@ class PlanarLattice3D:
 
     def addMeasurement(self,lat):
 
-        plaquette_layer=[1 for x in range(self.N)]
-        star_layer=[1 for x in range(self.N)]
-
-        for i in range(self.N):
-
-            Ppos=self.positions_P[i]
-            Spos=self.positions_S[i]
-
-            plaquette_layer[i]=lat.array[Ppos[0]][Ppos[1]]
-            star_layer[i]=lat.array[Spos[0]][Spos[1]]
-
-
-        new_syndrome_P=copy.copy(plaquette_layer)
-        new_syndrome_S=copy.copy(star_layer)
-
-
-        for i in range(self.N):
-            plaquette_layer[i]*=self.syndrome_P[i]
-            star_layer[i]*=self.syndrome_S[i]
+        values=lat.array.ravel()
+        new_syndrome_P=values[self.P_channels]
+        new_syndrome_S=values[self.S_channels]
 
-        self.parity_array_S+=[star_layer]
-        self.parity_array_P+=[plaquette_layer]
+        # The parity layer marks the stabilizers whose value changed since the previous measurement
+        self.parity_array_P+=[new_syndrome_P*self.syndrome_P]
+        self.parity_array_S+=[new_syndrome_S*self.syndrome_S]
 
         self.syndrome_P=new_syndrome_P
         self.syndrome_S=new_syndrome_S
 
-    def findAnyons(self):
-
-        self.getTime()
+    def anyonsPerTime(self,parity_array,positions):
+        """ returns, for each time slice, a tuple of the (t,x,y) positions of the -1 entries of the parity layers """
 
-        anyon_positions_x=()
-        anyon_positions_z=()
+        if self.time==0:
+            return ()
 
-        for t in range(self.time):
+        anyons=[[] for t in range(self.time)]
+        for k in np.flatnonzero(np.concatenate(parity_array)==-1).tolist():
+            t,i=divmod(k,self.N)
+            anyons[t].append((t,)+positions[i])
 
-            anyon_positions_x_t=()
-            anyon_positions_z_t=()
+        return tuple(tuple(anyons_t) for anyons_t in anyons)
 
-            for i in range(self.N):
 
+    def findAnyons(self):
 
-                if self.parity_array_P[t][i]==-1:
-                    anyon_positions_x_t+=((t,)+(self.positions_P[i]),)
-
-                if self.parity_array_S[t][i]==-1:
-                    anyon_positions_z_t+=((t,)+(self.positions_S[i]),)
+        self.getTime()
 
-            anyon_positions_x+=(anyon_positions_x_t,)
-            anyon_positions_z+=(anyon_positions_z_t,)
+        anyon_positions_x=self.anyonsPerTime(self.parity_array_P,self.positions_P)
+        anyon_positions_z=self.anyonsPerTime(self.parity_array_S,self.positions_S)
 
         self.anyon_positions_x=anyon_positions_x
         self.anyon_positions_z=anyon_positions_z
@@ -0,0 +1,141 @@
+# ------------ Monte Carlo threshold driver for the minimum weight perfect matching (MWPM) baseline ----------------
+#
+# usage: python planar_threshold.py results_file [num_workers]
+#
+# For every lattice size and error rate below, run3Drandom is repeated n_trials times, with tSteps = size rounds of faulty
+# measurements (p_meas = p_phys) followed by a perfect round. A trial fails if either logical operator is flipped.
+#
+# The trials of each point are split into shards of shard_size trials, which are distributed over a pool of worker processes.
+# Every shard draws from its own random stream, seeded by (seed, size, error rate, shard), so that results do not depend on
+# the number of workers or on the order in which shards complete. After every shard the aggregated failure counts, together
+# with Wilson confidence intervals for the logical failure rates, are written into results_file. If results_file already
+# exists, the shards it records as completed are skipped - an interrupted sweep can therefore simply be restarted, provided
+# n_trials, shard_size, seed and confidence are unchanged.
+
+import os
+import sys
+import pickle
+import random
+import multiprocessing
+from statistics import NormalDist
+
+import numpy as np
+
+import simulate_planar as sp
+
+# ---------------------------------------------------------------------------------------------
+
+sizes = [3, 5, 7, 9]
+error_rates = [0.01, 0.015, 0.02, 0.025, 0.03, 0.035, 0.04]
+n_trials = 10000
+shard_size = 500
+confidence = 0.99
+seed = 0
+
+# ---------------------------------------------------------------------------------------------
+
+def run_shard(shard):
+    """"
+    Runs the trials of a single shard, from the random stream of that shard.
+
+    :param: shard: A tuple (size, err_rate, shard_index, n_shard_trials)
+    :return: shard: The shard which was run
+    :return: failures: The number of trials with a logical failure
+    """
+
+    size, err_rate, shard_index, n_shard_trials = shard
+
+    stream = np.random.SeedSequence([seed, size, int(round(err_rate*1e6)), shard_index])
+    np.random.seed(stream.generate_state(4))
+    random.seed(int(stream.generate_state(1)[0]))
+
+    failures = 0
+    for j in range(n_shard_trials):
+        x, z = sp.run3Drandom(size, size, err_rate, err_rate)
+        if not (x == 1 and z == 1):
+            failures += 1
+
+    return shard, failures
+
+
+def wilson_interval(failures, trials, confidence):
+    """"
+    Wilson score interval for a binomial proportion.
+
+    :param: failures: The number of failed trials
+    :param: trials: The number of trials
+    :param: confidence: The confidence level of the interval
+    :return: lower, upper: The bounds of the interval
+    """
+
+    if trials == 0:
+        return 0.0, 1.0
+
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    rate = failures/trials
+    centre = (rate + z**2/(2*trials))/(1 + z**2/trials)
+    half_width = z*np.sqrt(rate*(1 - rate)/trials + z**2/(4*trials**2))/(1 + z**2/trials)
+
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def save_results(results, results_file):
+    # Write to a temporary file first, so that an interruption never leaves a partially written results file behind
+    tmp_file = results_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(results, f)
+    os.replace(tmp_file, results_file)
+
+# ---------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    results_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        num_workers = int(sys.argv[2])
+    else:
+        num_workers = int(os.environ.get("SLURM_NTASKS", multiprocessing.cpu_count()))
+
+    settings = {"n_trials": n_trials, "shard_size": shard_size, "seed": seed, "confidence": confidence}
+
+    if os.path.exists(results_file):
+        with open(results_file, "rb") as f:
+            results = pickle.load(f)
+        # Resumed shards must be the same trials, and all intervals must be at the same confidence
+        for key in settings.keys():
+            if results.get(key) != settings[key]:
+                raise Exception("the existing results file was produced with {} = {}, rather than {}!".format(key, results.get(key), settings[key]))
+    else:
+        results = dict(settings, points={})
+
+    # Collect the shards which have not been completed yet
+    pending = []
+    for size in sizes:
+        for err_rate in error_rates:
+            point = results["points"].setdefault((size, err_rate), {"trials": 0, "failures": 0, "completed_shards": set()})
+            for shard_index in range(int(np.ceil(n_trials/shard_size))):
+                n_shard_trials = min(shard_size, n_trials - shard_index*shard_size)
+                if shard_index not in point["completed_shards"]:
+                    pending.append((size, err_rate, shard_index, n_shard_trials))
+
+    print("{} shards to run, {} already completed".format(len(pending),
+          sum(len(point["completed_shards"]) for point in results["points"].values())))
+
+    with multiprocessing.Pool(processes=max(1, min(num_workers, len(pending)))) as pool:
+        for (size, err_rate, shard_index, n_shard_trials), failures in pool.imap_unordered(run_shard, pending):
+
+            point = results["points"][(size, err_rate)]
+            point["trials"] += n_shard_trials
+            point["failures"] += failures
+            point["completed_shards"].add(shard_index)
+            point["failure_rate"] = point["failures"]/point["trials"]
+            point["interval"] = wilson_interval(point["failures"], point["trials"], confidence)
+
+            save_results(results, results_file)
+
+    for size in sizes:
+        for err_rate in error_rates:
+            point = results["points"][(size, err_rate)]
+            if point["trials"] > 0:
+                print("d = {}, p = {}: failure rate {:.5f} in [{:.5f}, {:.5f}] from {} trials".format(
+                      size, err_rate, point["failure_rate"], point["interval"][0], point["interval"][1], point["trials"]))